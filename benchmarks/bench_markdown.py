@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Checks and times transform_to_markdown_compliant against its original implementation.
+
+The output for every body in the synthetic corpus, plus a large set of fuzzed bodies, must
+be identical to that of the original chain of re.sub passes; the script exits with an
+error if any differ.  It then reports the time taken by each implementation, with the
+memo cache both cold and warm.
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import corpus
+import migrateissues
+
+
+def original_transform_to_markdown_compliant(string):
+    # Escape chars interpreted as markdown formatting by GH
+    string = re.sub(r'(\s)~~', r'\1\\~~', string)
+    string = re.sub(r'\n(\s*)>', r'\n\1\\>', string)
+    string = re.sub(r'\n(\s*)#', r'\n\1\\#', string)
+    string = re.sub(r'(?m)^-([- \r]*)$', r'\\-\1', string)
+    # '==' is also making headers, but can't nicely escape ('\' shows up)
+    string = re.sub(r'(\S\s*\n)(=[= ]*(\r?\n|$))', r'\1\n\2', string)
+    # Escape < to avoid being treated as an html tag
+    string = re.sub(r'(\s)<', r'\1\\<', string)
+    # Avoid links that should not be links.
+    # I can find no way to escape the # w/o using backtics:
+    string = re.sub(r'(\s+)(#\d+)(\W)', r'\1`\2`\3', string)
+    # Create issue links
+    string = re.sub(r'\bi#(\d+)', r'issue #\1', string)
+    string = re.sub(r'\bissue (\d+)', r'issue #\1', string)
+    return string
+
+
+def check(bodies):
+    """ Returns the number of bodies whose transformed text differs, printing the first few. """
+
+    mismatches = 0
+    for body in bodies:
+        # Check byte strings too, since issue bodies are transformed after being encoded
+        for text in (body, body.encode('utf-8')):
+            expected = original_transform_to_markdown_compliant(text)
+            actual = migrateissues.transform_to_markdown_compliant(text)
+            if actual != expected or type(actual) != type(expected):
+                mismatches += 1
+                if mismatches <= 5:
+                    print 'Mismatch for %r:\n  expected %r\n  actual   %r' % (text, expected, actual)
+    return mismatches
+
+
+def timed(function, bodies, repeat):
+    best = None
+    for _ in xrange(repeat):
+        migrateissues.markdown_cache.clear()
+        start = time.time()
+        for body in bodies:
+            function(body)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage = "usage: %prog [options]", description = __doc__.strip().split('\n')[0])
+    parser.add_option('-n', '--count', dest = 'count', help = 'Number of comment bodies in the corpus', default = 2000, type = int)
+    parser.add_option('-r', '--repeat', dest = 'repeat', help = 'Number of timing runs; the best is reported', default = 3, type = int)
+    options, args = parser.parse_args()
+
+    bodies = corpus.comment_bodies(options.count)
+    fuzz = corpus.fuzz_bodies()
+
+    mismatches = check(bodies) + check(fuzz)
+    print 'Checked %d corpus and %d fuzzed bodies: %d mismatches' % (len(bodies), len(fuzz), mismatches)
+    if mismatches:
+        sys.exit(1)
+
+    size = sum(len(body) for body in bodies)
+    print 'Timing %d bodies, %.1f MB in total' % (len(bodies), size / 1e6)
+
+    original = timed(original_transform_to_markdown_compliant, bodies, options.repeat)
+    print '  original:         %.3fs' % original
+
+    cold = timed(migrateissues.transform_to_markdown_compliant, bodies, options.repeat)
+    print '  new, cold cache:  %.3fs (%.1fx)' % (cold, original / cold)
+
+    for body in bodies:
+        migrateissues.transform_to_markdown_compliant(body)
+    start = time.time()
+    for body in bodies:
+        migrateissues.transform_to_markdown_compliant(body)
+    warm = time.time() - start
+    print '  new, warm cache:  %.3fs (%.1fx)' % (warm, original / warm)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Times a complete migration between local fake Google Code and Github services.
+
+A project with the given number of issues and comments is generated and served by
+FakeGoogleCode, and migrated into an empty FakeGithub repository by migrate_project,
+exactly as migrateissues would from the command line, with the same options.  The
+script reports issues migrated per minute, Github requests per issue, and the wall and
+CPU time spent in each phase.
+
+The pauses that keep comments in order would dominate any run with real sleeps, so by
+default they are only added up: the fake Github creates each comment a second after the
+previous one, as though the pause had been taken, and the report shows the rate with and
+without them.  Pass --real-pacing to actually sleep.
+"""
+
+import optparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_services
+import migrateissues
+
+from fake_services import thread_cpu
+
+
+class Phases(object):
+    """ Adds up the calls, wall time and CPU time of the functions wrapped for each phase. """
+
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, name, function):
+        def timed(*args, **kwargs):
+            start, start_cpu = time.time(), thread_cpu()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.time() - start, thread_cpu() - start_cpu)
+        return timed
+
+    def add(self, name, wall, cpu):
+        with self.lock:
+            calls, total_wall, total_cpu = self.totals.get(name, (0, 0.0, 0.0))
+            self.totals[name] = (calls + 1, total_wall + wall, total_cpu + cpu)
+
+    def wrap_function(self, name, module, function_name):
+        setattr(module, function_name, self.wrap(name, getattr(module, function_name)))
+
+
+class SimulatedPacer(migrateissues.CommentPacer):
+    """ Adds up the pauses between comments instead of taking them. """
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.slept += seconds
+
+
+def setup(options, gcode, github_service, phases):
+    """ Sets migrateissues up as its __main__ would with the given options, against the fake
+    services.  Only Google Code's host and the password prompt are redirected.
+    """
+
+    m = migrateissues
+    m.options = options
+    m.options.github_url = github_service.url
+    m.github_user_name = github_service.owner
+
+    # Send Google Code requests to the fake service
+    m.GOOGLE_ISSUES_URL = m.GOOGLE_ISSUES_URL.replace('https://code.google.com', gcode.url)
+    fetch_gcode_page = m.fetch_gcode_page
+    m.fetch_gcode_page = lambda url: fetch_gcode_page(url.replace('http://code.google.com', gcode.url))
+    m.getpass.getpass = lambda prompt: 'password'
+
+    if not options.real_pacing:
+        m.CommentPacer = SimulatedPacer
+
+    for name, function_name in [('listing', 'get_gcode_csv_page'), ('scraping', 'fetch_gcode_page'),
+            ('parsing', 'parse_gcode_issue_page'), ('markdown', 'transform_to_markdown_compliant')]:
+        phases.wrap_function(name, m, function_name)
+    m.github_connections.request = phases.wrap('github', m.github_connections.request)
+
+    m.connect_to_github()
+
+
+if __name__ == "__main__":
+    # Every option of the migration itself is accepted too, but for those naming the
+    # projects to migrate and where to, which are the fake services
+    parser = migrateissues.make_option_parser()
+    parser.set_usage("usage: %prog [options]")
+    parser.description = __doc__.strip().split('\n')[0]
+    for option in ('--batch', '--batch-workers', '--github-url'):
+        parser.remove_option(option)
+    group = optparse.OptionGroup(parser, 'Benchmark options')
+    group.add_option('-n', '--issues', dest = 'issues', help = 'Number of Google Code issues', default = 50, type = int)
+    group.add_option('-m', '--comments', dest = 'comments', help = 'Number of comments on each issue', default = 5, type = int)
+    group.add_option('--github-latency', dest = 'github_latency', help = 'Seconds the fake Github takes to answer each request', default = 0.02, type = float)
+    group.add_option('--gcode-latency', dest = 'gcode_latency', help = 'Seconds the fake Google Code takes to answer each request', default = 0.05, type = float)
+    group.add_option('--connect-latency', dest = 'connect_latency', help = 'Seconds both fake services take to accept each connection', default = 0.05, type = float)
+    group.add_option('--rate-limit', dest = 'rate_limit', help = 'Github requests allowed per rate-limit window', default = 5000, type = int)
+    group.add_option('--rate-window', dest = 'rate_window', help = 'Length of the Github rate-limit window in seconds', default = 3600, type = int)
+    group.add_option('--real-pacing', action = 'store_true', dest = 'real_pacing', help = 'Really pause between comments, instead of adding the pauses up', default = False)
+    group.add_option('--attachments', action = 'store_true', dest = 'attachments', help = 'Mirror attachments, through a temporary --attachments-dir', default = False)
+    parser.add_option_group(group)
+    options, args = migrateissues.parse_options(parser, sys.argv[1:] + ['benchmark', 'benchmark', 'migrated'])
+    google_project_name, github_user_name, github_project = args
+    migrateissues.parser = parser
+
+    output = migrateissues.output
+    output('Generating %d issues with %d comments each...\n' % (options.issues, options.comments))
+    phases = Phases()
+    gcode = fake_services.FakeGoogleCode(google_project_name, options.issues, options.comments, options.gcode_latency)
+    github_service = fake_services.FakeGithub(github_user_name, github_project, options.github_latency, options.rate_limit,
+        options.rate_window, sequential_comments = not options.real_pacing)
+    gcode.connect_latency = github_service.connect_latency = options.connect_latency
+    gcode.start()
+    github_service.start()
+    if options.attachments:
+        options.attachments_dir = tempfile.mkdtemp()
+
+    # Keep the migration's progress output out of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start, start_cpu = time.time(), os.times()
+        setup(options, gcode, github_service, phases)
+        migrateissues.migrate_project(google_project_name, github_project)
+        elapsed, end_cpu = time.time() - start, os.times()
+    finally:
+        sys.stdout = stdout
+        gcode.stop()
+        github_service.stop()
+        if options.attachments:
+            shutil.rmtree(options.attachments_dir)
+
+    migrated = len(github_service.issues)
+    comments = sum(len(issue_comments) for issue_comments in github_service.comments.values())
+    if migrated != options.issues:
+        output('Warning: %d issues were migrated, not %d\n' % (migrated, options.issues))
+    if options.attachments:
+        # Every attachment was downloaded, so every link should be to its mirrored copy
+        bodies = [issue['body'] for issue in github_service.issues]
+        bodies.extend(comment['body'] for issue_comments in github_service.comments.values() for comment in issue_comments)
+        links = re.findall(r'^\*\*Attachment:\*\* \[.*\]\(([^)]+)\)$', u'\n'.join(bodies), re.M)
+        unmirrored = [link for link in links if not link.startswith(github_service.url + github_service.html_path + '/')]
+        if unmirrored:
+            output('Warning: %d of %d attachment links were not mirrored\n' % (len(unmirrored), len(links)))
+
+    cpu = (end_cpu[0] - start_cpu[0]) + (end_cpu[1] - start_cpu[1])
+    service_cpu = gcode.cpu + github_service.cpu
+    paused = migrateissues.comment_pacer.slept
+
+    output('Migrated %d issues with %d comments in %.1fs\n' % (migrated, comments, elapsed))
+    output('  issues per minute:          %.1f\n' % (60 * migrated / elapsed))
+    if not options.real_pacing:
+        output('  ... including comment pauses: %.1f (%.1fs of pauses)\n' % (60 * migrated / (elapsed + paused), paused))
+    output('  Github requests per issue:  %.2f (%d in total)\n' % (github_service.requests / float(migrated or 1), github_service.requests))
+    output('  Google Code requests:       %d over %d connections\n' % (gcode.requests, gcode.connections))
+    output('  Github connections:         %d\n' % github_service.connections)
+    if migrateissues.attachment_uploader:
+        output('  attachments:                %d downloaded, %d duplicates, %d uploaded\n' % (
+            gcode.attachments, migrateissues.attachment_store.duplicates, migrateissues.attachment_uploader.uploads))
+    output('  CPU time:                   %.2fs, excluding %.2fs in the fake services\n' % (cpu - service_cpu, service_cpu))
+
+    output('\n  %-18s %8s %10s %10s\n' % ('phase', 'calls', 'wall (s)', 'cpu (s)'))
+    for name in sorted(phases.totals):
+        calls, wall, phase_cpu = phases.totals[name]
+        output('  %-18s %8d %10.2f %10.2f\n' % (name, calls, wall, phase_cpu))
+
+    output('\n  %-28s %8s\n' % ('Github request', 'count'))
+    for key, count in sorted(github_service.counts.items(), key = lambda item: -item[1]):
+        output('  %-28s %8d\n' % (key, count))
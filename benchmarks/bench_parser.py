@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Compares the pyquery and lxml parsers for Google Code issue pages.
+
+Both parsers must produce identical issues for every page; the script exits with an error
+if any differ.  It then reports the time taken by each parser.  Pages are generated, or
+read from a --cache-dir populated by an earlier run of migrateissues.
+"""
+
+import glob
+import gzip
+import json
+import optparse
+import os
+import sys
+import time
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import corpus
+import migrateissues
+
+
+def generated_pages(count, comments):
+    return [(gid, corpus.issue_page('benchmark', gid, comments)) for gid in xrange(1, count + 1)]
+
+
+def cached_pages(cache_dir, project):
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(cache_dir, project, 'issue-*.json.gz'))):
+        with gzip.open(filename, 'rb') as f:
+            entry = json.loads(f.read().decode('utf-8'))
+        gid = int(os.path.basename(filename).split('.')[0].split('-')[1])
+        pages.append((gid, entry['page']))
+    return pages
+
+
+def parse(parser, gid, page):
+    migrateissues.options.parser = parser
+    issue = {
+        'gid': gid,
+        'link': migrateissues.GOOGLE_URL.format(migrateissues.google_project_name, gid),
+        'date': datetime(2012, 1, 1),
+    }
+    return migrateissues.parse_gcode_issue_page(issue, page)
+
+
+def timed(parser, pages, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for gid, page in pages:
+            parse(parser, gid, page)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage = "usage: %prog [options]", description = __doc__.strip().split('\n')[0])
+    parser.add_option('-n', '--pages', dest = 'pages', help = 'Number of pages to generate', default = 50, type = int)
+    parser.add_option('-m', '--comments', dest = 'comments', help = 'Number of comments on each generated page', default = 100, type = int)
+    parser.add_option('-r', '--repeat', dest = 'repeat', help = 'Number of timing runs; the best is reported', default = 3, type = int)
+    parser.add_option('--cache-dir', dest = 'cache_dir', help = 'Read saved pages from this migrateissues cache directory', default = None)
+    parser.add_option('--project', dest = 'project', help = 'Google Code project whose saved pages to read', default = 'benchmark')
+    options, args = parser.parse_args()
+
+    migrateissues.options = optparse.Values({'parser': 'pyquery'})
+    migrateissues.google_project_name = options.project
+
+    if options.cache_dir:
+        pages = cached_pages(options.cache_dir, options.project)
+    else:
+        pages = generated_pages(options.pages, options.comments)
+
+    mismatches = 0
+    for gid, page in pages:
+        expected = parse('pyquery', gid, page)
+        actual = parse('lxml', gid, page)
+        if actual != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print 'Mismatch for issue %d:\n  pyquery %r\n  lxml    %r' % (gid, expected, actual)
+    comments = sum(len(parse('lxml', gid, page)['comments']) for gid, page in pages)
+    print 'Checked %d pages with %d comments: %d mismatches' % (len(pages), comments, mismatches)
+    if mismatches:
+        sys.exit(1)
+
+    pyquery_time = timed('pyquery', pages, options.repeat)
+    print '  pyquery: %.3fs (%.1f ms per page)' % (pyquery_time, 1000 * pyquery_time / len(pages))
+    lxml_time = timed('lxml', pages, options.repeat)
+    print '  lxml:    %.3fs (%.1f ms per page, %.1fx)' % (lxml_time, 1000 * lxml_time / len(pages), pyquery_time / lxml_time)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+""" Synthetic Google Code content for the benchmarks.
+
+Everything is generated from a seeded random number generator, so that every run of a
+benchmark works on exactly the same corpus.
+"""
+
+import random
+import urllib
+
+WORDS = u'''the a to of and in is it that for on this with as be not but when crash
+    build fails patch attached works fixed still see log line error value file version
+    release windows linux mac python thread memory test sample reproduce steps expected
+    actual output instead option config ünïcödé naïve 50% 100% x=1 y==2'''.split()
+
+USERS = [u'alice', u'bob', u'carol', u'dave', u'eve', u'm...@gmail.com', u'project-member']
+
+# Fragments that exercise each of the markdown transformations
+FRAGMENTS = [
+    u'issue 12', u'i#345', u' #17 ', u'see #3.', u'\n> quoted reply', u'\n  > nested quote',
+    u'\n# not a heading', u'\n   #define FOO 1', u'\n---\n', u'\n- - -\n', u'\n-\r\n',
+    u'\nTitle\n=====\n', u'\n== ==\r\n', u' <b>bold</b>', u' <br/>', u'a<b', u' ~~strike~~',
+    u'\r\n', u'\n\n', u'\tindented\n', u'Traceback (most recent call last):\n  File "x.py", line 1\n',
+    u'#1#2', u'issue #9', u' #12a', u'\n#', u'<', u'~~', u'=', u'-',
+]
+
+
+def comment_body(rng, words):
+    """ Returns a comment body of roughly the given number of words. """
+
+    parts = []
+    for _ in xrange(words):
+        if rng.random() < 0.05:
+            parts.append(rng.choice(FRAGMENTS))
+        else:
+            parts.append(rng.choice(WORDS))
+        parts.append(rng.choice([u' ', u' ', u' ', u'\n', u'  ']))
+    return u''.join(parts)
+
+
+def comment_bodies(count = 2000, seed = 1):
+    """ Returns a list of comment bodies, from one-liners up to very long pastes. """
+
+    rng = random.Random(seed)
+    sizes = [5, 20, 80, 300, 1500]
+    return [comment_body(rng, rng.choice(sizes)) for _ in xrange(count)]
+
+
+def fuzz_bodies(count = 20000, seed = 2):
+    """ Returns short bodies made almost entirely of markdown-sensitive characters. """
+
+    rng = random.Random(seed)
+    alphabet = [u' ', u'\n', u'\r', u'\t', u'#', u'1', u'2', u'>', u'<', u'~', u'-', u'=',
+                u'i', u's', u'u', u'e', u'issue ', u'a', u'.', u'`', u'\\']
+    return [u''.join(rng.choice(alphabet) for _ in xrange(rng.randint(0, 40))) for _ in xrange(count)]
+
+
+def escape_html(text):
+    return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+
+
+def attachments_html(rng):
+    rows = []
+    for i in xrange(rng.randint(1, 3)):
+        name = u'%s-%d.%s' % (rng.choice(WORDS), i, rng.choice([u'txt', u'png', u'patch']))
+        if rng.random() < 0.2:
+            # Names that the markdown conversion rewrites
+            name = rng.choice([u'fix for issue %d.patch', u'patch #%d v2.diff']) % rng.randint(1, 99)
+        if rng.random() < 0.2:
+            # Deleted attachments keep their name, but lose their download link
+            rows.append(u'<tr><td><b>%s</b> (deleted)</td></tr>' % name)
+        else:
+            rows.append(u'<tr><td><b>%s</b><br>%d KB &nbsp; <a href="//%s.googlecode.com/issues/attachment?aid=%d&amp;name=%s">Download</a></td></tr>' % (
+                name, rng.randint(1, 900), rng.choice(WORDS), rng.randint(1, 10 ** 6), urllib.quote(name.encode('utf-8'))))
+    return u'<div class="attachments"><table>%s</table></div>' % u''.join(rows)
+
+
+def issue_page(project, gid, comments, seed = None):
+    """ Returns the HTML of a Google Code issue details page with the given number of comments.
+
+    The markup mimics the structure that migrateissues scrapes, including deleted comments
+    and attachments, status updates, and the sign-in prompt that shares the comment class.
+    """
+
+    rng = random.Random(gid if seed is None else seed)
+    user = lambda: u'<a class="userlink" href="/u/%s/">%s</a>' % ((rng.choice(USERS),) * 2)
+    date = lambda: u'<span class="date" title="%s">%s</span>' % (
+        u'Mon Jan %02d %02d:%02d:%02d 2012' % (rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)), u'Jan 2012')
+
+    parts = [u'<!DOCTYPE html>\n<html><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">',
+             u'<title>Issue %d - %s</title></head><body>' % (gid, project),
+             u'<div id="maincol"><div class="issuedescription vt"><div class="cursor_off vt issuedescription">',
+             u'<div class="author"><span class="role_label">Reported by</span> %s, %s</div>' % (user(), date()),
+             u'<pre>\n%s\n</pre>' % escape_html(comment_body(rng, rng.choice([20, 80, 300]))),
+             attachments_html(rng) if rng.random() < 0.3 else u'',
+             u'</div></div>']
+
+    for i in xrange(1, comments + 1):
+        deleted = rng.random() < 0.05
+        parts.append(u'<div class="cursor_off vt issuecomment%s" id="c%d">' % (u' delcom' if deleted else u'', i))
+        parts.append(u'<div class="author"><span class="cursor_off">Comment <a href="#c%d">%d</a></span> by %s, %s</div>' % (i, i, user(), date()))
+        if rng.random() < 0.2:
+            parts.append(u'<pre>\n<i>(No comment was entered for this change.)</i>\n</pre>')
+        else:
+            parts.append(u'<pre>\n%s\n</pre>' % escape_html(comment_body(rng, rng.choice([5, 20, 80, 300]))))
+        if rng.random() < 0.3:
+            parts.append(u'<div class="updates"><div class="round4"></div><div class="box-inner">\n'
+                         u'<b>Status:</b> %s\n<br><b>Labels:</b> -Priority-Low Priority-High\n<br></div></div>' % rng.choice([u'Fixed', u'Accepted', u'WontFix']))
+        if rng.random() < 0.1:
+            parts.append(attachments_html(rng))
+        parts.append(u'</div>')
+
+    parts.append(u'<div class="issuecomment"><a href="/accounts">Sign in</a> to add a comment</div></div></body></html>')
+    return u''.join(parts)
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+
+""" Local stand-ins for Google Code and the Github API, for benchmarking migrations.
+
+FakeGoogleCode serves the issues CSV listing, the issue detail pages and the attachments
+of a generated project, and FakeGithub implements the parts of the Github API that
+migrateissues uses, with a configurable latency, connection setup time and rate-limit.
+Both run on background threads, listening on an unused local port, and count the
+requests they receive and the CPU time they use.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import csv
+import hashlib
+import json
+import re
+import resource
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+from cStringIO import StringIO
+from datetime import datetime
+
+import corpus
+
+
+def github_time(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Linux's per-thread resource usage, which Python 2's resource module doesn't name
+RUSAGE_THREAD = 1
+
+
+def thread_cpu():
+    """ Returns the CPU time used by the calling thread, or by the process if unsupported. """
+
+    try:
+        usage = resource.getrusage(RUSAGE_THREAD)
+    except (ValueError, resource.error):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Handles each connection on a thread of its own, counting them and adding up the
+    CPU time they use.
+    """
+
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        # Both are recorded before the thread starts, so that stop() can't miss either
+        thread = threading.Thread(target = self.process_request_thread, args = (request, client_address))
+        thread.daemon = self.daemon_threads
+        with self.service.lock:
+            self.service.connections += 1
+            self.service.open_connections.add(request)
+            self.service.threads.add(thread)
+        thread.start()
+
+    def process_request_thread(self, request, client_address):
+        # Stands in for the TLS handshake that starts every connection to the real services
+        if self.service.connect_latency:
+            time.sleep(self.service.connect_latency)
+        start = thread_cpu()
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.service.lock:
+                self.service.cpu += thread_cpu() - start
+                self.service.open_connections.discard(request)
+                self.service.threads.discard(threading.current_thread())
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Passes each request on to the handle method of the fake service. """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Responses are written in two parts, the headers and the body, which would otherwise
+    # wait on the client's delayed acknowledgement of the first on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, verb):
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else None
+        status, headers, data = self.server.service.handle(verb, url.path, urlparse.parse_qs(url.query), self.headers, body)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_PATCH(self):
+        self.respond('PATCH')
+
+    def do_PUT(self):
+        self.respond('PUT')
+
+
+class FakeService(object):
+    """ Base class for the fake services, which runs the server and counts requests. """
+
+    def __init__(self, latency = 0):
+        self.latency = latency
+        self.connect_latency = 0
+        self.requests = 0
+        self.connections = 0
+        self.open_connections = set()
+        self.threads = set()
+        self.cpu = 0.0
+        self.lock = threading.Lock()
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.service = self
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        # Clients keep their connections open, so end them, and wait for their threads to
+        # finish rather than leave them to be killed while the interpreter shuts down
+        with self.lock:
+            connections = list(self.open_connections)
+            threads = list(self.threads)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for thread in threads:
+            thread.join()
+
+    def handle(self, verb, path, query, headers, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            return self.route(verb, path, query, headers, body)
+
+
+class FakeGoogleCode(FakeService):
+    """ Serves a Google Code project with the given number of issues, each with the given
+    number of comments.  Every fifth issue is closed.  Pages are generated up front, so
+    that serving them takes as little time as possible away from the migration.
+
+    Attachments link back to the fake service, with a download token like Google Code's.
+    Only 40 distinct files are served, so that many attachments are duplicates.
+    """
+
+    def __init__(self, project, issues, comments, latency = 0):
+        FakeService.__init__(self, latency)
+        self.project = project
+        self.rows = []
+        self.pages = {}
+        self.attachments = 0
+        attachment_link = r'href="%s/issues/attachment?\1&amp;token=T%d"'
+        for gid in xrange(1, issues + 1):
+            closed = gid % 5 == 0
+            self.rows.append([gid, 'Defect', 'Fixed' if closed else 'New', '', 'Generated issue %d' % gid,
+                'Jan 2012', 'Feb 2012' if closed else '', 'reporter', gid % 23,
+                'Mar 2012', 'Type-Defect, Priority-Medium, Milestone-Release1.%d' % (gid % 4), 1325419200 + gid * 3600,
+                1330560000 + gid * 3600])
+            page = corpus.issue_page(project, gid, comments).encode('utf-8')
+            self.pages[gid] = re.sub(r'href="//[^/"]+\.googlecode\.com/issues/attachment\?([^"]+)"', attachment_link % (self.url, gid), page)
+
+    def touch(self, gid, comment = u'Another comment'):
+        """ Adds a comment to the given issue, updating its modification time. """
+
+        with self.lock:
+            row = self.rows[gid - 1]
+            row[-1] = int(time.time())
+            number = self.pages[gid].count(' id="c') + 1
+            self.pages[gid] = self.pages[gid].replace('<div class="issuecomment"><a href="/accounts">',
+                ('<div class="cursor_off vt issuecomment" id="c%d"><div class="author"><span class="cursor_off">Comment '
+                 '<a href="#c%d">%d</a></span> by <a class="userlink" href="/u/bob/">bob</a>, <span class="date" '
+                 'title="Tue Feb 01 10:00:00 2012">Feb 2012</span></div><pre>\n%s\n</pre></div>'
+                 '<div class="issuecomment"><a href="/accounts">') % (number, number, number, comment.encode('utf-8')))
+
+    def route(self, verb, path, query, headers, body):
+        if path == '/p/%s/issues/csv' % self.project:
+            start = int(query['start'][0])
+            count = int(query['num'][0])
+            f = StringIO()
+            writer = csv.writer(f, dialect = csv.excel)
+            writer.writerow(['ID', 'Type', 'Status', 'Owner', 'Summary', 'Opened', 'Closed', 'Reporter',
+                'Stars', 'Modified', 'AllLabels', 'OpenedTimestamp', 'ModifiedTimestamp'])
+            writer.writerows(self.rows[start:start + count])
+            if start + count < len(self.rows):
+                writer.writerow(['This file is truncated to %d out of %d rows' % (count, len(self.rows)), ''])
+            return 200, [('Content-Type', 'text/csv; charset=UTF-8')], f.getvalue()
+
+        if path == '/p/%s/issues/detail' % self.project:
+            page = self.pages.get(int(query['id'][0]))
+            if page is not None:
+                return 200, [('Content-Type', 'text/html; charset=UTF-8')], page
+
+        if path == '/issues/attachment' and 'token' in query:
+            self.attachments += 1
+            aid = int(query['aid'][0]) % 40
+            return 200, [('Content-Type', 'application/octet-stream')], ('Attachment %d\n' % aid) * (aid * 50 + 1)
+        return 404, [('Content-Type', 'text/html; charset=UTF-8')], 'Not Found'
+
+
+class FakeGithub(FakeService):
+    """ Implements the Github API requests made by migrateissues, for a single repository.
+
+    Requests are rate-limited to `limit` per `window` seconds, advertised in the usual
+    headers, and GET responses carry an ETag for conditional requests.  If
+    sequential_comments is set, each comment is created at least one second after the
+    previous one on the same issue, by moving the fake Github's clock forward as though
+    the client had waited for it.
+
+    Files committed to branches and uploaded to releases can be downloaded from their
+    usual links under the repository's html_url, without counting against the rate-limit.
+    """
+
+    def __init__(self, owner, repo, latency = 0, limit = 5000, window = 3600, sequential_comments = False):
+        FakeService.__init__(self, latency)
+        self.owner = owner
+        self.repo = repo
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset = int(time.time()) + window
+        self.sequential_comments = sequential_comments
+        self.clock_skew = 0.0
+        self.counts = {}
+        self.issues = []
+        self.comments = {}
+        self.labels = {}
+        self.milestones = []
+        self.imports = []
+        self.comment_id = 0
+        self.repo_path = '/repos/%s/%s' % (owner, repo)
+        self.html_path = '/%s/%s' % (owner, repo)
+        self.refs = {}          # branch name -> {path: content}
+        self.releases = []      # (tag name, {asset name: content})
+
+    def respond(self, status, data, extra = ()):
+        headers = [
+            ('Content-Type', 'application/json; charset=utf-8'),
+            ('X-RateLimit-Limit', str(self.limit)),
+            ('X-RateLimit-Remaining', str(self.remaining)),
+            ('X-RateLimit-Reset', str(self.reset))
+        ]
+        return status, headers + list(extra), json.dumps(data)
+
+    def page(self, path, query, items):
+        """ Responds with one page of the given items, linking to the next page if any. """
+
+        per_page = int(query.get('per_page', ['30'])[0])
+        page = int(query.get('page', ['1'])[0])
+        extra = []
+        if page * per_page < len(items):
+            parameters = dict((name, values[0]) for name, values in query.iteritems())
+            parameters['page'] = str(page + 1)
+            extra.append(('Link', '<%s%s?%s>; rel="next"' % (self.url, path, urllib.urlencode(parameters))))
+        return self.respond(200, items[(page - 1) * per_page:page * per_page], extra)
+
+    def user_json(self):
+        return {'login': self.owner, 'id': 1, 'url': '%s/users/%s' % (self.url, self.owner)}
+
+    def label_json(self, name):
+        return {'name': name, 'color': self.labels[name], 'url': '%s%s/labels/%s' % (self.url, self.repo_path, urllib.quote(name))}
+
+    def issue_json(self, issue):
+        data = dict(issue)
+        data['url'] = '%s%s/issues/%d' % (self.url, self.repo_path, issue['number'])
+        data['labels'] = [self.label_json(name) for name in issue['labels']]
+        data['comments'] = len(self.comments[issue['number']])
+        data['milestone'] = self.milestones[issue['milestone'] - 1] if issue['milestone'] else None
+        data['assignee'] = self.user_json() if issue['assignee'] else None
+        return data
+
+    def add_issue(self, fields, labels, created_at = None):
+        for name in labels:
+            self.labels.setdefault(name, 'FFFFFF')
+        issue = {
+            'number': len(self.issues) + 1,
+            'title': fields['title'],
+            'body': fields.get('body'),
+            'state': 'closed' if fields.get('closed') else 'open',
+            'labels': list(labels),
+            'milestone': fields.get('milestone'),
+            'assignee': fields.get('assignee'),
+            'created_at': created_at or github_time(time.time()),
+            'updated_at': github_time(time.time())
+        }
+        self.issues.append(issue)
+        self.comments[issue['number']] = []
+        return issue
+
+    def add_comment(self, number, body, created_at = None):
+        comments = self.comments[number]
+        now = time.time() + self.clock_skew
+        if created_at is None:
+            if self.sequential_comments and comments and int(now) <= int(comments[-1]['timestamp']):
+                self.clock_skew += int(comments[-1]['timestamp']) + 1 - now
+                now = int(comments[-1]['timestamp']) + 1
+            created_at = github_time(now)
+        self.comment_id += 1
+        comment = {
+            'id': self.comment_id,
+            'body': body,
+            'created_at': created_at,
+            'timestamp': now,
+            'url': '%s%s/issues/comments/%d' % (self.url, self.repo_path, self.comment_id)
+        }
+        comments.append(comment)
+        return comment
+
+    def download(self, path):
+        """ Returns a file committed to a branch or uploaded to a release, or None. """
+
+        match = re.match(re.escape(self.html_path) + r'/raw/([^/]+)/(.+)$', path)
+        if match:
+            return self.refs.get(urllib.unquote(match.group(1)), {}).get(match.group(2))
+        match = re.match(re.escape(self.html_path) + r'/releases/download/([^/]+)/(.+)$', path)
+        if match:
+            for tag, assets in self.releases:
+                if tag == urllib.unquote(match.group(1)):
+                    return assets.get(match.group(2))
+
+    def route(self, verb, path, query, headers, body):
+        if verb == 'GET' and path.startswith(self.html_path + '/'):
+            data = self.download(path)
+            if data is None:
+                return 404, [('Content-Type', 'text/plain')], 'Not Found'
+            return 200, [('Content-Type', 'application/octet-stream')], data
+
+        if time.time() >= self.reset:
+            self.remaining = self.limit
+            self.reset = int(time.time()) + self.window
+        if self.remaining <= 0:
+            return self.respond(403, {'message': 'API rate limit exceeded'})
+        self.remaining -= 1
+
+        # Count requests by verb and the kind of resource they're for
+        kind = re.sub(r'/(contents|heads|tags)/.+', r'/\1/:name', path.replace(self.repo_path, ':repo', 1))
+        kind = re.sub(r'/\d+', '/:id', kind)
+        kind = re.sub(r'/labels/.+', '/labels/:name', kind)
+        key = '%s %s' % (verb, kind)
+
+        # Release assets are uploaded as they are, rather than as JSON
+        if body and headers.get('content-type') != 'application/octet-stream':
+            body = json.loads(body)
+        status, response_headers, data = self.resource(verb, path, query, headers, body)
+
+        # Like Github, answer conditional requests for unchanged resources with 304 Not
+        # Modified, without counting them against the rate-limit
+        if verb == 'GET' and status == 200:
+            etag = '"%s"' % hashlib.sha1(data).hexdigest()
+            if headers.get('if-none-match') == etag:
+                self.remaining += 1
+                key += ' (304)'
+                status, response_headers, data = self.respond(304, None)
+                data = ''
+            response_headers.append(('ETag', etag))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return status, response_headers, data
+
+    def resource(self, verb, path, query, headers, payload):
+        repo = self.repo_path
+
+        if path in ('/user', '/users/' + self.owner):
+            return self.respond(200, self.user_json())
+        if path == repo:
+            return self.respond(200, {'name': self.repo, 'full_name': '%s/%s' % (self.owner, self.repo),
+                'url': self.url + repo, 'html_url': self.url + self.html_path, 'owner': self.user_json()})
+
+        if path == repo + '/issues':
+            if verb == 'POST':
+                issue = self.add_issue(payload, payload.get('labels', []))
+                return self.respond(201, self.issue_json(issue))
+            state = query.get('state', ['open'])[0]
+            issues = [issue for issue in self.issues if state in ('all', issue['state'])]
+            if 'labels' in query:
+                wanted = set(query['labels'][0].split(','))
+                issues = [issue for issue in issues if wanted <= set(issue['labels'])]
+            return self.page(path, query, [self.issue_json(issue) for issue in issues])
+
+        match = re.match(re.escape(repo) + r'/issues/(\d+)(/comments)?$', path)
+        if match and int(match.group(1)) <= len(self.issues):
+            issue = self.issues[int(match.group(1)) - 1]
+            if match.group(2):
+                if verb == 'POST':
+                    return self.respond(201, self.add_comment(issue['number'], payload['body']))
+                return self.page(path, query, self.comments[issue['number']])
+            if verb == 'PATCH':
+                for field in ('title', 'body', 'state', 'labels', 'milestone'):
+                    if field in payload:
+                        issue[field] = payload[field]
+                if 'assignee' in payload:
+                    issue['assignee'] = payload['assignee']
+            return self.respond(200, self.issue_json(issue))
+
+        if path == repo + '/import/issues':
+            if 'golden-comet-preview' not in headers.get('accept', ''):
+                return self.respond(415, {'message': 'Unsupported media type'})
+            if verb == 'POST':
+                issue = self.add_issue(payload['issue'], payload['issue'].get('labels', []), payload['issue'].get('created_at'))
+                for comment in payload.get('comments', []):
+                    self.add_comment(issue['number'], comment['body'], comment.get('created_at'))
+                status = {'id': len(self.imports) + 1, 'status': 'imported', 'created_at': github_time(time.time()),
+                    'issue_url': '%s%s/issues/%d' % (self.url, repo, issue['number'])}
+                self.imports.append(status)
+                # Imports are reported as pending until their status is first checked
+                return self.respond(202, dict(status, status = 'pending'))
+            since = query.get('since', [''])[0]
+            return self.respond(200, [status for status in self.imports if status['created_at'] >= since])
+
+        match = re.match(re.escape(repo) + r'/import/issues/(\d+)$', path)
+        if match and verb == 'GET':
+            number = int(match.group(1))
+            if not 0 < number <= len(self.imports):
+                return self.respond(404, {'message': 'Not Found'})
+            return self.respond(200, self.imports[number - 1])
+
+        if path == repo + '/labels':
+            if verb == 'POST':
+                if payload['name'] in self.labels:
+                    return self.respond(422, {'message': 'Validation Failed', 'errors': [{'code': 'already_exists'}]})
+                self.labels[payload['name']] = payload['color']
+                return self.respond(201, self.label_json(payload['name']))
+            return self.page(path, query, [self.label_json(name) for name in sorted(self.labels)])
+        match = re.match(re.escape(repo) + r'/labels/(.+)$', path)
+        if match:
+            name = urllib.unquote(match.group(1))
+            if name in self.labels:
+                return self.respond(200, self.label_json(name))
+
+        if path == repo + '/milestones':
+            if verb == 'POST':
+                if any(milestone['title'] == payload['title'] for milestone in self.milestones):
+                    return self.respond(422, {'message': 'Validation Failed', 'errors': [{'code': 'already_exists'}]})
+                number = len(self.milestones) + 1
+                milestone = {'number': number, 'title': payload['title'], 'state': 'open',
+                    'url': '%s%s/milestones/%d' % (self.url, repo, number)}
+                self.milestones.append(milestone)
+                return self.respond(201, milestone)
+            state = query.get('state', ['open'])[0]
+            return self.page(path, query, [milestone for milestone in self.milestones if state in ('all', milestone['state'])])
+
+        # Just enough of the git data API to start a branch with an unrelated history
+        if path in (repo + '/git/trees', repo + '/git/commits') and verb == 'POST':
+            return self.respond(201, {'sha': hashlib.sha1(json.dumps(payload)).hexdigest()})
+        if path == repo + '/git/refs' and verb == 'POST':
+            name = payload['ref'].replace('refs/heads/', '', 1)
+            if name in self.refs:
+                return self.respond(422, {'message': 'Reference already exists'})
+            self.refs[name] = {}
+            return self.respond(201, {'ref': payload['ref'], 'object': {'sha': payload['sha']}})
+        match = re.match(re.escape(repo) + r'/git/refs/heads/(.+)$', path)
+        if match and urllib.unquote(match.group(1)) in self.refs:
+            return self.respond(200, {'ref': 'refs/heads/' + urllib.unquote(match.group(1)), 'object': {'sha': '0' * 40}})
+
+        match = re.match(re.escape(repo) + r'/contents/(.+)$', path)
+        if match and verb == 'PUT':
+            files = self.refs.get(payload.get('branch'))
+            if files is None:
+                return self.respond(404, {'message': 'Branch not found'})
+            if match.group(1) in files:
+                return self.respond(422, {'message': '"sha" wasn\'t supplied.'})
+            files[match.group(1)] = base64.b64decode(payload['content'])
+            return self.respond(201, {'content': {'path': match.group(1)}})
+
+        if path == repo + '/releases' and verb == 'POST':
+            if any(tag == payload['tag_name'] for tag, _ in self.releases):
+                return self.respond(422, {'message': 'Validation Failed', 'errors': [{'code': 'already_exists'}]})
+            self.releases.append((payload['tag_name'], {}))
+            return self.respond(201, self.release_json(len(self.releases)))
+        match = re.match(re.escape(repo) + r'/releases/tags/(.+)$', path)
+        if match:
+            for number, (tag, _) in enumerate(self.releases, 1):
+                if tag == urllib.unquote(match.group(1)):
+                    return self.respond(200, self.release_json(number))
+        match = re.match(re.escape(repo) + r'/releases/(\d+)/assets$', path)
+        if match and verb == 'POST' and int(match.group(1)) <= len(self.releases):
+            assets = self.releases[int(match.group(1)) - 1][1]
+            name = query['name'][0]
+            if name in assets:
+                return self.respond(422, {'message': 'Validation Failed', 'errors': [{'code': 'already_exists'}]})
+            assets[name] = payload
+            return self.respond(201, {'name': name, 'size': len(payload)})
+
+        return self.respond(404, {'message': 'Not Found'})
+
+    def release_json(self, number):
+        return {'id': number, 'tag_name': self.releases[number - 1][0],
+            'upload_url': '%s%s/releases/%d/assets{?name,label}' % (self.url, self.repo_path, number)}
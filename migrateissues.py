@@ -1,34 +1,110 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import base64
+import calendar
+import contextlib
 import csv
+import errno
 import getpass
+import gzip
+import hashlib
+import httplib
+import itertools
+import json
 import logging
+import math
+import multiprocessing
 import optparse
+import os
 import re
+import socket
+import sqlite3
 import sys
-import urllib2
+import threading
+import urllib
 import time
+import urlparse
 
+from collections import deque
+from collections import OrderedDict
 from datetime import datetime
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+from select import select as select_sockets
+
+# Python 2 lazily imports this on the first call to strptime, which isn't thread-safe, so
+# make sure it's loaded before pages are parsed on prefetch threads.
+import _strptime
 
 from github import Github
 from github import GithubException
+from github import UnknownObjectException
+from github.Issue import Issue
+from github.Label import Label
+from github.Milestone import Milestone
+from github.NamedUser import NamedUser
+from lxml import etree
+from lxml import html as lxml_html
 from pyquery import PyQuery as pq
 
 # The maximum number of records to retrieve from Google Code in a single request
-GOOGLE_MAX_RESULTS = 25
+GOOGLE_MAX_RESULTS = 100
 
 GOOGLE_ISSUE_TEMPLATE = '_Original issue: {}_'
-GOOGLE_ISSUES_URL = 'https://code.google.com/p/{}/issues/csv?can=1&num={}&start={}&colspec=ID%20Type%20Status%20Owner%20Summary%20Opened%20Closed%20Reporter%20Stars&sort=id'
+GOOGLE_ISSUES_URL = 'https://code.google.com/p/{}/issues/csv?can=1&num={}&start={}&colspec=ID%20Type%20Status%20Owner%20Summary%20Opened%20Closed%20Reporter%20Stars%20Modified&sort=id'
 GOOGLE_URL = 'http://code.google.com/p/{}/issues/detail?id={}'
 GOOGLE_URL_RE = 'http://code.google.com/p/%s/issues/detail\?id=(\d+)'
 GOOGLE_ID_RE = GOOGLE_ISSUE_TEMPLATE.format(GOOGLE_URL_RE)
 
-# The minimum number of remaining Github rate-limited API requests before we pre-emptively
-# abort to avoid hitting the limit part-way through migrating an issue.
+# How long to wait for a single prefetched Google Code page before giving up.  Waiting
+# with a timeout also keeps the main thread responsive to Ctrl-C under Python 2.
+GOOGLE_PREFETCH_TIMEOUT = 600
+
+# Bump this whenever the format of parsed issues changes, so that cached pages are re-parsed
+GOOGLE_CACHE_VERSION = 2
+
+# How long to wait for a response on a kept-alive connection, and how many redirects to follow
+HTTP_TIMEOUT = 60
+HTTP_MAX_REDIRECTS = 5
+
+# The number of items to request per page when listing Github issues, labels, etc.
+GITHUB_PER_PAGE = 100
+
+# The length of Github's rate-limit window, in seconds
+GITHUB_RATE_WINDOW = 3600
+
+# The minimum number of remaining Github rate-limited API requests to keep in reserve; if
+# migrating an issue could dip into them, we wait for the rate-limit to reset first.
 GITHUB_SPARE_REQUESTS = 50
 
+# Seconds to back off after hitting Github's secondary (abuse) rate-limit, doubled on each
+# successive retry, and the number of retries before giving up on a request.
+GITHUB_ABUSE_BACKOFF = 60
+GITHUB_MAX_RETRIES = 5
+
+# The media type that enables Github's Issue Import API, and the number of imports to
+# submit before waiting for them to finish, polling their statuses every few seconds.
+GITHUB_IMPORT_MEDIA_TYPE = 'application/vnd.github.golden-comet-preview+json'
+GITHUB_IMPORT_BATCH = 50
+GITHUB_IMPORT_POLL_INTERVAL = 2
+
+# How long to wait for a write worker to sync a single issue before giving up.  As with
+# prefetching, waiting with a timeout keeps the main thread responsive to Ctrl-C.
+GITHUB_WRITE_TIMEOUT = 86400
+
+# The delay after each comment used by the 'fixed' comment pacing strategy
+COMMENT_FIXED_DELAY = 5
+
+# The initial safety margin, in seconds, used by the 'adaptive' comment pacing strategy
+COMMENT_ADAPTIVE_MARGIN = 0.05
+
+# Bump this whenever the format of migration plan files changes
+MIGRATION_PLAN_VERSION = 2
+
+# How often, in seconds, to write metrics to the --metrics file
+METRICS_INTERVAL = 10
+
 # Mapping from Google Code issue labels to Github labels
 LABEL_MAPPING = {
     'Type-Defect' : 'bug',
@@ -59,9 +135,29 @@ def stars_to_label(stars):
     else:
         return '21+ stars'
 
+# Output from write workers is collected per issue, so that issues don't interleave
+output_local = threading.local()
+output_lock = threading.Lock()
+
 def output(string):
-    sys.stdout.write(string)
-    sys.stdout.flush()
+    buffer = getattr(output_local, 'buffer', None)
+    if buffer is not None:
+        buffer.append(string)
+        return
+    with output_lock:
+        sys.stdout.write(string)
+        sys.stdout.flush()
+
+@contextlib.contextmanager
+def buffered_output():
+    """ Collects the calling thread's output, and writes it all at once at the end. """
+
+    output_local.buffer = []
+    try:
+        yield
+    finally:
+        buffer, output_local.buffer = output_local.buffer, None
+        output(''.join(buffer))
 
 def spacing_template(wordList, spacing=12):
     output = []
@@ -76,46 +172,158 @@ def escape(s):
         s = s.replace('%', '&#37;')  # Escape % signs
     return s
 
-def transform_to_markdown_compliant(string):
+# Substitutions applied, in order, by transform_to_markdown_compliant.  Each pattern is
+# paired with substrings that must all be present for it to match, so that passes which
+# can't change the text are skipped without running the regular expression.
+MARKDOWN_SUBSTITUTIONS = [
     # Escape chars interpreted as markdown formatting by GH
-    string = re.sub(r'(\s)~~', r'\1\\~~', string)
-    string = re.sub(r'\n(\s*)>', r'\n\1\\>', string)
-    string = re.sub(r'\n(\s*)#', r'\n\1\\#', string)
-    string = re.sub(r'(?m)^-([- \r]*)$', r'\\-\1', string)
+    (re.compile(r'(\s)~~'), r'\1\\~~', ('~~',)),
+    (re.compile(r'\n(\s*)>'), r'\n\1\\>', ('\n', '>')),
+    (re.compile(r'\n(\s*)#'), r'\n\1\\#', ('\n', '#')),
+    (re.compile(r'(?m)^-([- \r]*)$'), r'\\-\1', ('-',)),
     # '==' is also making headers, but can't nicely escape ('\' shows up)
-    string = re.sub(r'(\S\s*\n)(=[= ]*(\r?\n|$))', r'\1\n\2', string)
+    (re.compile(r'(\S\s*\n)(=[= ]*(\r?\n|$))'), r'\1\n\2', ('\n=',)),
     # Escape < to avoid being treated as an html tag
-    string = re.sub(r'(\s)<', r'\1\\<', string)
+    (re.compile(r'(\s)<'), r'\1\\<', ('<',)),
     # Avoid links that should not be links.
     # I can find no way to escape the # w/o using backtics:
-    string = re.sub(r'(\s+)(#\d+)(\W)', r'\1`\2`\3', string)
+    (re.compile(r'(\s+)(#\d+)(\W)'), r'\1`\2`\3', ('#',)),
     # Create issue links
-    string = re.sub(r'\bi#(\d+)', r'issue #\1', string)
-    string = re.sub(r'\bissue (\d+)', r'issue #\1', string)
-    return string
+    (re.compile(r'\bi#(\d+)'), r'issue #\1', ('i#',)),
+    (re.compile(r'\bissue (\d+)'), r'issue #\1', ('issue ',)),
+]
+
+# The number of transformed bodies to remember, keyed by a digest of the original text
+MARKDOWN_CACHE_SIZE = 4096
+
+markdown_cache = OrderedDict()
+markdown_cache_lock = threading.Lock()
+
+def transform_to_markdown_compliant(string):
+    # Byte strings and unicode strings give results of their own type, so key on both
+    key = (type(string), hashlib.sha1(string.encode('utf-8') if isinstance(string, unicode) else string).digest())
+    with markdown_cache_lock:
+        try:
+            transformed = markdown_cache.pop(key)
+            markdown_cache[key] = transformed
+            return transformed
+        except KeyError:
+            pass
+
+    transformed = string
+    with metrics.timer('markdown_transform'):
+        for pattern, replacement, required in MARKDOWN_SUBSTITUTIONS:
+            if all(substring in transformed for substring in required):
+                transformed = pattern.sub(replacement, transformed)
+
+    with markdown_cache_lock:
+        markdown_cache[key] = transformed
+        if len(markdown_cache) > MARKDOWN_CACHE_SIZE:
+            markdown_cache.popitem(last = False)
+    return transformed
+
+# Guards the label and milestone caches, which write workers share
+github_cache_lock = threading.Lock()
 
 def github_label(name, color = "FFFFFF"):
     """ Returns the Github label with the given name, creating it if necessary. """
 
-    try:
-        return label_cache[name]
-    except KeyError:
+    # Github label names are case-insensitive
+    with github_cache_lock:
         try:
-            return label_cache.setdefault(name, github_repo.get_label(name))
-        except GithubException:
-            return label_cache.setdefault(name, github_repo.create_label(name, color))
+            return label_cache[name.lower()]
+        except KeyError:
+            try:
+                return label_cache.setdefault(name.lower(), github_repo.get_label(name))
+            except GithubException:
+                return label_cache.setdefault(name.lower(), github_repo.create_label(name, color))
 
 
 def get_github_milestone(name):
     """ Returns the Github milestone with the given name, creating it if necessary. """
 
-    try:
-        return milestone_cache[name]
-    except KeyError:
-        for milestone in list(github_repo.get_milestones()):
-            if milestone.title == name:
-                return milestone_cache.setdefault(name, milestone)
-        return milestone_cache.setdefault(name, github_repo.create_milestone(name))
+    with github_cache_lock:
+        try:
+            return milestone_cache[name]
+        except KeyError:
+            for milestone in github_repo.get_milestones(state = 'all'):
+                milestone_cache.setdefault(milestone.title, milestone)
+            if name not in milestone_cache:
+                milestone_cache[name] = github_repo.create_milestone(name)
+            return milestone_cache[name]
+
+
+def list_github_labels():
+    """ Fills the label and milestone caches with every label and milestone on Github. """
+
+    output('Retrieving existing Github labels and milestones...\n')
+    for label in github_repo.get_labels():
+        label_cache[label.name.lower()] = label
+    for milestone in github_repo.get_milestones(state = 'all'):
+        milestone_cache[milestone.title] = milestone
+
+
+def missing_github_labels(issue_summaries):
+    """ Returns the names of the labels and milestones that the given issues need and that
+    aren't in the caches, worked out from the issue listing.
+    """
+
+    labels = set(['imported'])
+    milestones = set()
+    for issue_summary in issue_summaries:
+        issue_labels, milestone = get_gcode_labels(issue_summary)
+        labels.update(issue_labels)
+        if milestone:
+            milestones.add(milestone)
+    missing_labels = sorted(label for label in labels if label.lower() not in label_cache)
+    missing_milestones = sorted(milestone for milestone in milestones if milestone not in milestone_cache)
+    return missing_labels, missing_milestones
+
+
+def prewarm_github_caches(issue_summaries):
+    """ Yields the given issue summaries, filling the label and milestone caches as they go.
+
+    All existing labels and milestones are listed once, before the first summary, and
+    any that an issue needs but that are missing are created before its summary is
+    passed on, so that migrating an issue needs no label or milestone requests.  The
+    listing is streamed rather than read in full first, so the total number of issues
+    is only given to the metrics once it's all been read.
+    """
+
+    list_github_labels()
+    count = 0
+    for issue_summary in issue_summaries:
+        count += 1
+        missing_labels, missing_milestones = missing_github_labels([issue_summary])
+        if missing_labels or missing_milestones:
+            output('Creating %d labels and %d milestones\n' % (len(missing_labels), len(missing_milestones)))
+            create_github_labels(missing_labels, missing_milestones)
+        yield issue_summary
+    metrics.issues_total = count
+
+
+def create_github_labels(labels, milestones):
+    """ Creates the given labels and milestones, and adds them to the caches.
+
+    They may have been created since they were found to be missing, by a batch worker
+    migrating another project to the same repository, or by an earlier run, so any that
+    Github rejects are fetched instead.
+    """
+
+    for name in labels:
+        try:
+            label_cache[name.lower()] = github_repo.create_label(name, "FFFFFF")
+        except GithubException:
+            label_cache[name.lower()] = github_repo.get_label(name)
+        if journal:
+            journal.record_label(name)
+    for name in milestones:
+        try:
+            milestone_cache[name] = github_repo.create_milestone(name)
+        except GithubException:
+            get_github_milestone(name)
+        if journal:
+            journal.record_milestone(name, milestone_cache[name].number)
 
 
 def parse_gcode_date(date_text):
@@ -129,116 +337,1560 @@ def parse_gcode_date(date_text):
     return parsed.strftime("%B %d, %Y %H:%M:%S")
 
 
-def add_issue_to_github(issue):
-    """ Migrates the given Google Code issue to Github. """
+def atomic_write(path, data, compress = False):
+    """ Writes data to the given file, gzipped if compress is set, through a temporary file.
 
-    # Github rate-limits API requests to 5000 per hour, and if we hit that limit part-way
-    # through adding an issue it could end up in an incomplete state.  To avoid this we'll
-    # ensure that there are enough requests remaining before we start migrating an issue.
+    The file is only replaced once it's complete, so an interrupted run can't leave a
+    truncated file behind, and other threads and processes never see a partial one.
+    """
 
-    if github.rate_limiting[0] < GITHUB_SPARE_REQUESTS:
-        raise Exception('Aborting to to impending Github API rate-limit cutoff.')
+    temp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    with (gzip.open if compress else open)(temp_path, 'wb') as f:
+        f.write(data)
+    os.rename(temp_path, path)
 
-    body = issue['content'].replace('%', '&#37;')
 
-    output('Adding issue %d' % issue['gid'])
+def github_endpoint(url):
+    """ Returns the path of a Github API URL, with its owner, repository and numbers elided. """
 
-    if options.verbose:
-        output('\n')
-        outList = [
-            spacing_template(['Title', issue['title']]),
-            spacing_template(['State', issue['state']]),
-            spacing_template(['Labels', issue['labels']]),
-            spacing_template(['Milestone', issue['milestone']]),
-            spacing_template(['Source link', issue['link']])
+    path = urlparse.urlparse(url).path
+    path = re.sub(r'/repos/[^/]+/[^/]+', '/repos/:owner/:repo', path)
+    path = re.sub(r'/labels/[^/]+', '/labels/:name', path)
+    return re.sub(r'/\d+(?=/|$)', '/:number', path)
+
+
+class Metrics(object):
+    """ Times each phase of the migration, and counts Github requests by endpoint and status.
+
+    A progress line can be printed after each issue.  With a path, snapshots are written
+    every METRICS_INTERVAL seconds and at the end of the migration, either appended as
+    JSON lines or as a Prometheus textfile that is replaced each time, for the node
+    exporter's textfile collector to pick up.
+    """
+
+    def __init__(self, path = None, format = 'jsonl', progress = False):
+        self.path = path
+        self.format = format
+        self.progress = progress
+        self.started = time.time()
+        self.written = self.started
+        self.timers = {}
+        self.requests = {}
+        self.issues_total = None
+        self.issues_done = 0
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                count, seconds = self.timers.get(phase, (0, 0.0))
+                self.timers[phase] = (count + 1, seconds + elapsed)
+
+    def count_request(self, verb, url, status):
+        key = (verb, github_endpoint(url), status)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def start(self, issues_total):
+        """ Starts measuring progress through the given number of issues, if it's known. """
+
+        self.started = time.time()
+        self.issues_total = issues_total
+        self.issues_done = 0
+
+    def issue_done(self, scheduler):
+        """ Records that an issue has been processed, printing progress if requested. """
+
+        self.issues_done += 1
+        if self.progress:
+            output(self.describe_progress(scheduler) + '\n')
+        if self.path and time.time() - self.written >= METRICS_INTERVAL:
+            self.write(scheduler)
+
+    def rate(self):
+        """ Returns the number of issues processed per second so far. """
+
+        elapsed = time.time() - self.started
+        return self.issues_done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, scheduler):
+        """ Returns the estimated number of seconds left, or None if it can't be estimated.
+
+        The remaining issues take as long as the issues so far did, unless they need more
+        requests than the rate-limit allows before it resets, in which case they take at
+        least until the last reset they need.
+        """
+
+        if not self.issues_total or not self.issues_done:
+            return None
+        remaining = max(self.issues_total - self.issues_done, 0)
+        seconds = remaining / self.rate()
+
+        if scheduler.remaining is not None and scheduler.limit and scheduler.reset:
+            with self.lock:
+                requests = sum(self.requests.values())
+            needed = float(requests) / self.issues_done * remaining
+            available = scheduler.remaining - scheduler.spare
+            if needed > available:
+                resets = math.ceil((needed - available) / max(scheduler.limit - scheduler.spare, 1))
+                seconds = max(seconds, scheduler.reset - time.time() + (resets - 1) * GITHUB_RATE_WINDOW)
+        return seconds
+
+    def describe_progress(self, scheduler):
+        """ Returns a line describing progress so far, with the throughput and ETA. """
+
+        line = 'Progress: %d' % self.issues_done
+        if self.issues_total:
+            line += '/%d' % self.issues_total
+        line += ' issues, %.1f per minute' % (self.rate() * 60)
+        if scheduler.remaining is not None:
+            line += ', %d Github requests left' % scheduler.remaining
+        eta = self.eta(scheduler)
+        if eta is not None:
+            line += ', ETA %s' % timedelta(seconds = int(eta))
+        return line
+
+    def snapshot(self, scheduler):
+        eta = self.eta(scheduler)
+        with self.lock:
+            return {
+                'time': time.time(),
+                'elapsed': time.time() - self.started,
+                'issues_done': self.issues_done,
+                'issues_total': self.issues_total,
+                'eta': eta,
+                'rate_limit_remaining': scheduler.remaining,
+                'phases': dict((phase, {'count': count, 'seconds': seconds})
+                    for phase, (count, seconds) in self.timers.iteritems()),
+                'github_requests': [{'method': verb, 'endpoint': endpoint, 'status': status, 'count': count}
+                    for (verb, endpoint, status), count in sorted(self.requests.iteritems())]
+            }
+
+    def write(self, scheduler):
+        """ Writes a snapshot of the metrics to the metrics file. """
+
+        self.written = time.time()
+        snapshot = self.snapshot(scheduler)
+        if self.format == 'jsonl':
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(snapshot) + '\n')
+            return
+
+        lines = [
+            '# HELP migrateissues_issues_done Google Code issues processed so far',
+            '# TYPE migrateissues_issues_done gauge',
+            'migrateissues_issues_done %d' % snapshot['issues_done']
+        ]
+        if snapshot['issues_total'] is not None:
+            lines += [
+                '# HELP migrateissues_issues_total Google Code issues to process',
+                '# TYPE migrateissues_issues_total gauge',
+                'migrateissues_issues_total %d' % snapshot['issues_total']
+            ]
+        if snapshot['eta'] is not None:
+            lines += [
+                '# HELP migrateissues_eta_seconds Estimated time left',
+                '# TYPE migrateissues_eta_seconds gauge',
+                'migrateissues_eta_seconds %f' % snapshot['eta']
+            ]
+        if snapshot['rate_limit_remaining'] is not None:
+            lines += [
+                '# HELP migrateissues_github_rate_limit_remaining Github requests left before the rate-limit resets',
+                '# TYPE migrateissues_github_rate_limit_remaining gauge',
+                'migrateissues_github_rate_limit_remaining %d' % snapshot['rate_limit_remaining']
+            ]
+        lines += [
+            '# HELP migrateissues_phase_seconds_total Time spent in each phase of the migration',
+            '# TYPE migrateissues_phase_seconds_total counter'
+        ]
+        lines += ['migrateissues_phase_seconds_total{phase="%s"} %f' % (phase, timer['seconds'])
+            for phase, timer in sorted(snapshot['phases'].iteritems())]
+        lines += [
+            '# HELP migrateissues_phase_calls_total Number of times each phase of the migration ran',
+            '# TYPE migrateissues_phase_calls_total counter'
         ]
-        output('\n'.join(outList))
-
-    github_issue = None
-
-    if not options.dry_run:
-        github_labels = [github_label(label) for label in issue['labels']]
-        text = body.encode('utf-8')
-        text = transform_to_markdown_compliant(text)
-        if issue['milestone']:
-            github_milestone = get_github_milestone(issue['milestone'])
-            github_issue = github_repo.create_issue(issue['title'], body = text, labels = github_labels,
-                milestone = github_milestone)
+        lines += ['migrateissues_phase_calls_total{phase="%s"} %d' % (phase, timer['count'])
+            for phase, timer in sorted(snapshot['phases'].iteritems())]
+        lines += [
+            '# HELP migrateissues_github_requests_total Github API requests, by endpoint and status',
+            '# TYPE migrateissues_github_requests_total counter'
+        ]
+        lines += ['migrateissues_github_requests_total{method="%(method)s",endpoint="%(endpoint)s",status="%(status)d"} %(count)d' % request
+            for request in snapshot['github_requests']]
+
+        # Replaced atomically, so that the collector never reads a partial file
+        atomic_write(self.path, '\n'.join(lines) + '\n')
+
+
+# Metrics for the migration, replaced by one set up from the command line options
+metrics = Metrics()
+
+
+class RateLimitScheduler(object):
+    """ Routes every Github API request through a single rate-limit budget.
+
+    The remaining quota and reset time are tracked from the headers of every response.
+    When the quota runs out, or an issue is about to need more requests than are left,
+    we sleep until the limit resets instead of failing.  Requests rejected by Github's
+    secondary (abuse) rate-limit are retried after the advertised or an exponential delay.
+    """
+
+    def __init__(self, spare = GITHUB_SPARE_REQUESTS):
+        self.spare = spare
+        self.remaining = None
+        self.limit = None
+        self.reset = None
+        self.reserved = 0
+        self.condition = threading.Condition()
+        self.waited = 0.0
+
+    def install(self, github_client):
+        """ Makes the given Github client send all of its requests through this scheduler. """
+
+        # PyGithub doesn't offer a hook for this, but all of a client's objects share its
+        # requester, and all of their requests go through its requestJson method.
+        requester = github_client._Github__requester
+        request = requester.requestJson
+        def scheduled_request(verb, url, parameters, input):
+            return self.request(request, verb, url, parameters, input)
+        requester.requestJson = scheduled_request
+
+    def request(self, request, *args):
+        for retry in xrange(GITHUB_MAX_RETRIES + 1):
+            if self.remaining is not None and self.remaining <= 0:
+                self.wait_for_reset()
+
+            status, headers, output = request(*args)
+            self.update(headers)
+            verb, url = args[:2]
+            metrics.count_request(verb, url, status)
+
+            if status not in (403, 429) or retry == GITHUB_MAX_RETRIES:
+                break
+            delay = self.backoff(retry, headers, output)
+            if delay is None:
+                break
+            self.sleep(delay, 'Github rate-limited a request')
+        return status, headers, output
+
+    def update(self, headers):
+        if 'x-ratelimit-remaining' in headers:
+            self.remaining = int(headers['x-ratelimit-remaining'])
+        if 'x-ratelimit-limit' in headers:
+            self.limit = int(headers['x-ratelimit-limit'])
+        if 'x-ratelimit-reset' in headers:
+            self.reset = int(headers['x-ratelimit-reset'])
+
+    def backoff(self, retry, headers, output):
+        """ Returns how long to wait before retrying a rejected request, or None if it shouldn't be. """
+
+        if 'retry-after' in headers:
+            return int(headers['retry-after'])
+        if self.remaining == 0 and self.reset is not None:
+            return self.reset - time.time() + 1
+        message = (output or '').lower()
+        if 'abuse' in message or 'secondary rate limit' in message:
+            return GITHUB_ABUSE_BACKOFF * 2 ** retry
+        return None
+
+    def reserve(self, cost):
+        """ Waits for the rate-limit to reset if fewer than `cost` spare requests are left.
+
+        Github rate-limits API requests to 5000 per hour, and if we hit that limit part-way
+        through adding an issue it could end up in an incomplete state.  Reserving the cost
+        of an issue before starting on it avoids this.  Requests reserved by issues still
+        being synced on other threads don't count as left, so concurrent issues wait for
+        those to finish first; call release() once an issue is done.
+        """
+
+        with self.condition:
+            while self.remaining is not None and self.remaining - self.reserved - cost < self.spare:
+                if not self.reserved:
+                    self.wait_for_reset()
+                    break
+                # Waiting with a timeout keeps the thread responsive to Ctrl-C
+                self.condition.wait(1)
+            self.reserved += cost
+
+    def release(self, cost):
+        with self.condition:
+            self.reserved -= cost
+            self.condition.notify_all()
+
+    def wait_for_reset(self):
+        if self.reset is None:
+            return
+        self.sleep(self.reset - time.time() + 1, 'Github rate-limit nearly exhausted')
+        self.remaining = self.limit
+
+    def sleep(self, seconds, reason):
+        if seconds <= 0:
+            return
+        output('\n%s; waiting %d seconds\n' % (reason, seconds))
+        with metrics.timer('rate_limit_wait'):
+            time.sleep(seconds)
+        self.waited += seconds
+
+
+def shared_value(index):
+    """ Returns a property for one of a SharedRateLimitScheduler's shared values. """
+
+    def get(self):
+        value = self.values[index]
+        return None if math.isnan(value) else int(value)
+    def set(self, value):
+        self.values[index] = float('nan') if value is None else value
+    return property(get, set)
+
+
+class SharedRateLimitScheduler(RateLimitScheduler):
+    """ A RateLimitScheduler whose budget is shared with the processes forked after it's made.
+
+    Github's rate-limit applies to the user, however many processes make requests.  The
+    remaining quota, reset time and reserved requests are kept in shared memory, and the
+    condition that reservations wait on is shared too, so that processes migrating
+    different projects reserve requests from one budget.
+    """
+
+    remaining = shared_value(0)
+    limit = shared_value(1)
+    reset = shared_value(2)
+    reserved = shared_value(3)
+
+    def __init__(self, spare = GITHUB_SPARE_REQUESTS):
+        self.values = multiprocessing.Array('d', 4)
+        RateLimitScheduler.__init__(self, spare)
+        self.condition = multiprocessing.Condition()
+
+
+def estimate_github_requests(issue, new_issue):
+    """ Returns an upper bound on the Github requests needed to migrate the given issue. """
+
+    # Uploading each attached file, unless an earlier issue already did, after finding or
+    # creating the branch or release to upload them to
+    requests = 0
+    if attachment_uploader:
+        requests += sum(len(attachment['files']) for attachment in issue['attachments'])
+        if requests and not attachment_uploader.prepared:
+            requests += 4
+
+    # Importing the issue, and checking on its import
+    if new_issue and github_importer:
+        return requests + 2
+
+    # Creating the issue or listing its comments, posting each comment, assigning and closing
+    requests += 3 + len(issue['comments'])
+    if not new_issue:
+        requests += len(issue['comments']) // GITHUB_PER_PAGE
+    return requests
+
+
+def github_label_name(name):
+    """ Returns the name of the Github label for the given name, as spelled on Github if it exists. """
+
+    label = label_cache.get(name.lower())
+    return label.name if label else name
+
+
+def new_plan_entry(gid, state, fingerprint):
+    return {
+        'gid': gid,
+        'state': state,                 # the state the Github issue should end up in
+        'fingerprint': fingerprint,
+        'number': None,                 # the Github issue number, if it already exists
+        'github_state': None,           # the Github issue's state before syncing
+        'placeholder': False,
+        'import': False,                # whether to create the issue with the Issue Import API
+        'issue': None,                  # the issue to create, if it doesn't exist yet
+        'comments': [],                 # the comments to post
+        'present': [],                  # digests of comments that are already on Github
+        'attachments': [],              # digests of attached files to upload first
+        'requests': 0
+    }
+
+
+def plan_issue(issue, existing_issue):
+    """ Returns the plan entry for syncing the given Google Code issue to Github.
+
+    Nothing is changed on Github, but the comments on an issue's existing Github copy are
+    listed, to find out which are still missing.  existing_issue is the (Github issue
+    number, state) of that copy, or None if the issue hasn't been migrated yet.
+    """
+
+    entry = new_plan_entry(issue['gid'], issue['state'], issue['fingerprint'])
+    attachments = []
+    present = set()
+    if existing_issue:
+        entry['number'], entry['github_state'] = existing_issue
+        if journal and journal.is_complete(issue):
+            return entry
+        present = set(comment_digest(comment.body) for comment in get_github_issue(*existing_issue).get_comments())
+    else:
+        # Google Code's opening times are Unix timestamps, held in local time
+        opened = datetime.utcfromtimestamp(time.mktime(issue['date'].timetuple()))
+        content, digests = mirror_attachments(issue, issue['content'])
+        attachments.extend(digests)
+        entry['issue'] = {
+            'title': issue['title'],
+            'body': transform_to_markdown_compliant(content.replace('%', '&#37;')),
+            'labels': [github_label_name(label) for label in issue['labels']],
+            'milestone': issue['milestone'],
+            'assignee': github_user.login if issue['owner'] and options.assign_owner else None,
+            'created_at': opened.strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        entry['import'] = github_importer is not None
+        entry['github_state'] = 'open'
+
+    for comment in issue['comments']:
+        # Comments are known by the digest of their Google Code text, whether or not
+        # their attachment links were rewritten when they were posted
+        digest = comment_digest(render_comment(comment))
+        # Attachment links are found by their Google Code text, which the markdown
+        # conversion may change, so they're mirrored before the comment is rendered
+        body, digests = mirror_attachments(issue, comment['body'])
+        mirrored = render_comment(dict(comment, body = body))
+        if digest in present or comment_digest(mirrored) in present:
+            entry['present'].append(digest)
         else:
-            github_issue = github_repo.create_issue(issue['title'], body = text, labels = github_labels)
-        if options.verbose and github_issue:
-            output('\n')
-            output(spacing_template(['Dest link', github_issue.url]))
+            entry['comments'].append({'body': mirrored, 'digest': digest, 'created_at': github_timestamp(comment['date'])})
+            attachments.extend(digests)
+    if attachment_uploader:
+        entry['attachments'] = attachment_uploader.pending(sorted(set(attachments)))
+    entry['requests'] = plan_requests(entry)
+    return entry
+
+
+def plan_placeholder(gid):
+    """ Returns the plan entry for a closed dummy issue standing in for a missing Google Code issue. """
+
+    body = '_Skipping this issue number to maintain synchronization with Google Code issue IDs._'
+    footer = GOOGLE_ISSUE_TEMPLATE.format(GOOGLE_URL.format(google_project_name, gid))
+    entry = new_plan_entry(gid, 'closed', None)
+    entry['placeholder'] = True
+    entry['issue'] = {
+        'title': 'Google Code skipped issue %d' % gid,
+        'body': body + '\n\n' + footer,
+        'labels': [github_label_name('imported')],
+        'milestone': None,
+        'assignee': None,
+        'created_at': None
+    }
+    entry['github_state'] = 'open'
+    entry['requests'] = plan_requests(entry)
+    return entry
 
-    # Assigns issues that originally had an owner to the current user
-    if issue['owner'] and options.assign_owner:
-        assignee = github.get_user(github_user.login)
-        if not options.dry_run:
-            github_issue.edit(assignee = assignee)
 
-    return github_issue
+def plan_requests(entry):
+    """ Returns the exact number of Github requests needed to carry out the given plan entry.
+
+    Imported issues get their comments and state along with them, but the imports' status
+    is checked separately, for a whole batch at a time.  Attached files are uploaded one
+    request each.
+    """
+
+    if entry['issue'] and entry['import']:
+        return 1 + len(entry['attachments'])
+    requests = len(entry['attachments']) + len(entry['comments'])
+    if entry['issue']:
+        requests += 1
+    if entry['github_state'] != entry['state']:
+        requests += 1
+    return requests
+
+
+def execute_plan_entry(entry, existing_issues):
+    """ Makes the Github requests planned for one issue, recording each in the journal.
 
+    Steps that the index of existing issues or the journal show were already carried out,
+    by an earlier run that was interrupted, are skipped.  Issues created here are added to
+    the index.
+    """
+
+    gid = entry['gid']
+    if entry['attachments']:
+        attachment_uploader.upload(entry['attachments'])
 
-def add_comments_to_issue(github_issue, gcode_issue):
-    """ Migrates all comments from a Google Code issue to its Github copy. """
+    existing_issue = existing_issues.get(gid)
+    if existing_issue:
+        github_issue = get_github_issue(*existing_issue)
+        output('Not adding issue %d (exists)' % gid)
+    elif entry['import']:
+        import_plan_entry(entry)
+        output('\n')
+        return
+    else:
+        github_issue = create_github_issue(entry)
+        existing_issues[gid] = (github_issue.number, github_issue.state)
 
-    # Retrieve existing Github comments, to figure out which Google Code comments are new
-    existing_comments = [comment.body for comment in github_issue.get_comments()]
+    # Comments already on an existing issue may have been posted since it was planned
+    posted = set()
+    if journal:
+        journal.record_comments(gid, entry['present'])
+        if existing_issue:
+            posted = journal.comment_digests(gid)
 
-    # Add any remaining comments to the Github issue
     output("\nSyncing comments ")
-    for i, comment in enumerate(gcode_issue['comments']):
-        body = u'_From {author} on {date}_\n\n{body}'.format(**comment)
-        topost = transform_to_markdown_compliant(body)
-        if topost in existing_comments:
-            logging.info('Skipping comment %d: already present', i + 1)
-        else:
-            logging.info('Adding comment %d', i + 1)
-            if options.verbose:
-                output('\n\tAdd: From {author} on {date}'.format(**comment))
-            if not options.dry_run:
-                topost = topost.encode('utf-8')
-                github_issue.create_comment(topost)
-
-                # We use a delay to avoid comments being created on GitHub
-                # in the wrong order, due to network non-determinism.
-                # Without this delay, I consistently observed a full 1 in 3
-                # GoogleCode issue comments being reordered.
-                # XXX: querying GitHub in a loop to see when the comment has
-                # been posted may be faster, but will cut into the rate limit.
-                time.sleep(5)
+    comment_pacer.begin_issue()
+    for i, comment in enumerate(entry['comments']):
+        if comment['digest'] in posted:
+            logging.info('Skipping comment %d: already posted', i + 1)
+            continue
+        logging.info('Adding comment %d', i + 1)
+        if options.verbose:
+            output('\n\tAdd: ' + comment['body'].split('\n', 1)[0].strip('_'))
+
+        # Comments posted in quick succession can be reordered on Github due
+        # to network non-determinism, so let the pacer space them out.
+        comment_pacer.post(github_issue, comment['body'].encode('utf-8'))
+        if journal:
+            journal.record_comments(gid, [comment['digest']])
+
+    if github_issue.state != entry['state']:
+        with metrics.timer('state_edit'):
+            github_issue.edit(state = entry['state'])
+    existing_issues[gid] = (github_issue.number, entry['state'])
+    if journal:
+        journal.record_synced(gid, entry['state'])
+        if entry['fingerprint']:
+            journal.record_fingerprint(gid, entry['fingerprint'])
+    output('\n')
+
+
+def output_new_issue(entry):
+    """ With --verbose, prints the details of an issue about to be created. """
+
+    if not options.verbose:
+        return
+    issue = entry['issue']
+    output('\n')
+    outList = [
+        spacing_template(['Title', issue['title']]),
+        spacing_template(['State', entry['state']]),
+        spacing_template(['Labels', issue['labels']]),
+        spacing_template(['Milestone', issue['milestone']]),
+        spacing_template(['Comments', len(entry['comments'])]),
+        spacing_template(['Source link', GOOGLE_URL.format(google_project_name, entry['gid'])])
+    ]
+    output('\n'.join(outList))
+
+
+def create_github_issue(entry):
+    """ Creates the Github issue in the given plan entry, without its comments. """
+
+    issue = entry['issue']
+    if entry['placeholder']:
+        output('Creating dummy entry for missing issue %d' % entry['gid'])
+    else:
+        output('Adding issue %d' % entry['gid'])
+        output_new_issue(entry)
+
+    attributes = {'body': issue['body'], 'labels': [github_label(label) for label in issue['labels']]}
+    if issue['milestone']:
+        attributes['milestone'] = get_github_milestone(issue['milestone'])
+    # Assigns issues that originally had an owner to the current user
+    if issue['assignee']:
+        attributes['assignee'] = NamedUser(github_repo._requester, {'login': issue['assignee']}, completed = False)
+    with metrics.timer('issue_create'):
+        github_issue = github_repo.create_issue(issue['title'], **attributes)
+    if journal:
+        journal.record_issue(entry['gid'], github_issue.number, github_issue.state)
+    if options.verbose:
+        output('\n')
+        output(spacing_template(['Dest link', github_issue.url]))
+    return github_issue
+
+
+def github_timestamp(date_text):
+    """ Returns the ISO 8601 form of a date from parse_gcode_date, or None if it isn't one. """
+
+    try:
+        return datetime.strptime(date_text, "%B %d, %Y %H:%M:%S").strftime('%Y-%m-%dT%H:%M:%SZ')
+    except ValueError:
+        return None
+
+
+def parse_github_timestamp(text):
+    """ Returns the Unix time of an ISO 8601 timestamp from Github, which may have
+    fractional seconds and a UTC offset.
+    """
+
+    match = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(?:Z|([+-])(\d\d):?(\d\d))$', text)
+    if not match:
+        raise ValueError('Unrecognised Github timestamp %r' % text)
+    seconds = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S'))
+    if match.group(2):
+        offset = int(match.group(3)) * 3600 + int(match.group(4)) * 60
+        seconds += -offset if match.group(2) == '+' else offset
+    return seconds
+
+
+def import_plan_entry(entry):
+    """ Submits the issue in the given plan entry, with all its comments, to the Issue Import API. """
+
+    issue = entry['issue']
+    output('Importing issue %d' % entry['gid'])
+    output_new_issue(entry)
+
+    github_issue = {
+        'title': issue['title'],
+        'body': issue['body'],
+        'created_at': issue['created_at'],
+        'closed': entry['state'] == 'closed',
+        'labels': [github_label(label).name for label in issue['labels']]
+    }
+    if issue['milestone']:
+        github_issue['milestone'] = get_github_milestone(issue['milestone']).number
+    if issue['assignee']:
+        github_issue['assignee'] = issue['assignee']
+
+    # The comments are created in the order given, so they need no pacing
+    comments = []
+    for comment in entry['comments']:
+        github_comment = {'body': comment['body']}
+        if comment['created_at']:
+            github_comment['created_at'] = comment['created_at']
+        comments.append(github_comment)
+
+    digests = [comment['digest'] for comment in entry['comments']]
+    with metrics.timer('issue_import'):
+        github_importer.submit(entry['gid'], entry['state'], entry['fingerprint'], digests, {'issue': github_issue, 'comments': comments})
+
+
+class GithubImporter(object):
+    """ Creates Github issues through the Issue Import API, each with all its comments.
+
+    An issue is imported in a single request, with its labels, milestone, assignee, state
+    and comments, instead of one request per comment spaced out to keep them in order.
+    Github processes imports asynchronously, so they are submitted in batches and then
+    their statuses are checked together, with one request listing every recent import.
+    Each import is recorded in the journal, if there is one, as soon as it's submitted,
+    so that a run interrupted before its imports finished can find out what became of
+    them instead of importing the issues again.
+    """
+
+    def __init__(self, scheduler, repo_url, login, password, journal = None, batch_size = GITHUB_IMPORT_BATCH):
+        self.scheduler = scheduler
+        self.journal = journal
+        self.url = repo_url + '/import/issues'
+        self.authorization = 'Basic ' + base64.b64encode('%s:%s' % (login, password))
+        self.batch_size = batch_size
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.imported = 0
+        self.failed = 0
+
+    def send(self, verb, url, input):
+        data = json.dumps(input) if input is not None else None
+        return github_connections.request(verb, url, {
+            'Accept': GITHUB_IMPORT_MEDIA_TYPE,
+            'Authorization': self.authorization,
+            'Content-Type': 'application/json',
+            'User-Agent': 'PyGithub/Python'
+        }, data)
+
+    def request(self, verb, url, input = None):
+        # Share the rate-limit budget, and its retries, with the Github client
+        status, headers, data = self.scheduler.request(self.send, verb, url, input)
+        data = json.loads(data) if data else None
+        if status >= 400:
+            raise GithubException(status, data)
+        return data
+
+    def submit(self, gid, state, fingerprint, digests, payload):
+        """ Starts importing an issue; call wait() to find out when it's been created. """
+
+        status = self.request('POST', self.url, payload)
+        if self.journal:
+            self.journal.record_import(status['id'], gid, state, fingerprint, digests, status.get('created_at'))
+        with self.lock:
+            self.pending[status['id']] = (gid, state, fingerprint, digests, status.get('created_at'))
+
+    def resume(self):
+        """ Looks up the imports an earlier run submitted but didn't see finish.
+
+        Those still being processed are added to the pending imports, and the rest are
+        returned like wait() returns them.  Imports that Github no longer knows about are
+        taken to have failed, so that their issues are migrated again.
+        """
+
+        entries = self.journal.pending_imports()
+        with self.lock:
+            self.pending.update(entries)
+        statuses = dict((status['id'], status) for status in self.statuses())
+
+        finished = []
+        for import_id, entry in entries.iteritems():
+            status = statuses.get(import_id)
+            if status is None:
+                # The listing only goes back so far, so ask about this one on its own
+                try:
+                    status = self.request('GET', '%s/%d' % (self.url, import_id))
+                except GithubException as e:
+                    if e.status != 404:
+                        raise
+                    status = {'status': 'failed', 'errors': 'Github has no import %d' % import_id}
+            if status['status'] != 'pending':
+                with self.lock:
+                    del self.pending[import_id]
+                finished.extend(self.finish(import_id, status, entry[:-1]))
+        return finished
+
+    def finish(self, import_id, status, entry):
+        """ Returns the tuple for an import that was processed, or nothing if it failed. """
+
+        gid, state, fingerprint, digests = entry
+        if status['status'] == 'imported':
+            number = int(status['issue_url'].rstrip('/').rsplit('/', 1)[1])
+            self.imported += 1
+            return [(gid, number, state, fingerprint, digests)]
+        logging.error('Failed to import issue %d: %r', gid, status.get('errors'))
+        self.failed += 1
+        # Let the issue be imported again
+        if self.journal:
+            self.journal.forget_import(import_id)
+        return []
+
+    def statuses(self):
+        """ Lists the statuses of all pending imports, and of any imported since. """
+
+        # Listing the imports created since the oldest pending one covers all of them
+        # in a single request; fall back to our clock, with a margin for skew, if Github
+        # didn't tell us when it was created.  Creation times may come with different
+        # UTC offsets, so they're compared, and sent back, in UTC.
+        with self.lock:
+            created = [parse_github_timestamp(entry[-1]) for entry in self.pending.values() if entry[-1]]
+            complete = len(created) == len(self.pending)
+        since = min(created) if complete else time.time() - 3600
+        since = datetime.utcfromtimestamp(since).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return self.request('GET', '%s?%s' % (self.url, urllib.urlencode({'since': since})))
+
+    def check(self):
+        """ Checks the status of all pending imports, returning those that finished. """
+
+        statuses = self.statuses()
+        finished = []
+        with self.lock:
+            for status in statuses:
+                if status['id'] not in self.pending or status['status'] == 'pending':
+                    continue
+                entry = self.pending.pop(status['id'])
+                finished.extend(self.finish(status['id'], status, entry[:-1]))
+        return finished
+
+    def wait(self):
+        """ Waits for all pending imports to finish.
+
+        Returns a list of (Google Code issue number, Github issue number, state, fingerprint,
+        comment digests) tuples for the issues that were imported; failed imports are logged.
+        """
+
+        finished = []
+        while self.pending:
+            with metrics.timer('import_wait'):
+                finished.extend(self.check())
+                if self.pending:
+                    time.sleep(GITHUB_IMPORT_POLL_INTERVAL)
+        return finished
+
+
+class CommentPacer(object):
+    """ Spaces out the comments posted to an issue so that Github keeps them in order.
+
+    Github orders comments by creation time, which only has a resolution of one second,
+    so comments posted in quick succession can end up reordered.  The 'fixed' strategy
+    simply waits five seconds after each comment.  The 'adaptive' strategy instead waits
+    only until Github's clock has moved past the second in which the previous comment was
+    created, using a lower bound on the offset between Github's clock and ours that is
+    learned from the creation times of earlier comments.
+
+    Issues may be synced on several threads at once, each posting to one issue at a
+    time, so the previous comment's creation time is kept per thread.
+    """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.margin = COMMENT_ADAPTIVE_MARGIN
+        self.clock_offset = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.posted = 0
+        self.slept = 0.0
+
+    def begin_issue(self):
+        """ Resets ordering state; comments on different issues don't need spacing. """
+        self.local.previous = None
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with metrics.timer('comment_pacing'):
+                time.sleep(seconds)
+            with self.lock:
+                self.slept += seconds
+
+    def post(self, github_issue, body):
+        """ Adds a comment to the given Github issue, after waiting as long as needed. """
+
+        previous = getattr(self.local, 'previous', None)
+        if self.strategy == 'adaptive' and previous is not None:
+            self.sleep(previous + 1 - self.clock_offset + self.margin - time.time())
+
+        with metrics.timer('comment_post'):
+            comment = github_issue.create_comment(body)
+        received = time.time()
+        with self.lock:
+            self.posted += 1
+
+        if self.strategy == 'fixed':
+            self.sleep(COMMENT_FIXED_DELAY)
+            return comment
+
+        # The comment was created no later than our receipt of the response, so this gives
+        # a lower bound on how far Github's clock is ahead of ours.
+        created = calendar.timegm(comment.created_at.utctimetuple())
+        offset = created - received
+        with self.lock:
+            self.clock_offset = offset if self.clock_offset is None else max(self.clock_offset, offset)
+            if previous is not None and created <= previous:
+                self.margin = min(self.margin * 2, COMMENT_FIXED_DELAY)
+                logging.warn('Comment created in the same second as the previous one; pacing margin is now %.2fs', self.margin)
+        self.local.previous = created
+        return comment
+
+    def saved(self):
+        """ Returns the number of seconds saved compared with the fixed delay. """
+        return self.posted * COMMENT_FIXED_DELAY - self.slept
+
+
+def comment_digest(body):
+    """ Returns a digest identifying a comment body, ignoring line endings and outer whitespace. """
+
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    return hashlib.sha1(body.replace('\r\n', '\n').strip()).hexdigest()
+
+
+def render_comment(comment):
+    """ Returns the Github comment body for the given Google Code comment. """
+
+    body = u'_From {author} on {date}_\n\n{body}'.format(**comment)
+    return transform_to_markdown_compliant(body)
+
+
+class MigrationJournal(object):
+    """ SQLite journal of the issues and comments already migrated to Github.
+
+    The journal maps each Google Code issue to its Github issue number, and records the
+    digest of every comment posted to it, the issue's last known state, and whether it
+    has been fully synced.  Issues submitted to the Issue Import API are recorded with
+    their import ID until the import is seen to finish, and the labels and milestones
+    created on Github are recorded too.  Every change is committed
+    immediately, so an interrupted run can resume by skipping complete issues without
+    making any Github requests.
+    """
+
+    def __init__(self, path, project, repo):
+        self.project = project
+        self.repo = repo
+        # The connection is shared by write workers, which take turns using it
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.lock = threading.Lock()
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS issues (
+                project TEXT NOT NULL, repo TEXT NOT NULL, gid INTEGER NOT NULL,
+                number INTEGER NOT NULL, state TEXT NOT NULL, synced INTEGER NOT NULL,
+                updated REAL NOT NULL, PRIMARY KEY (project, repo, gid))''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS comments (
+                project TEXT NOT NULL, repo TEXT NOT NULL, gid INTEGER NOT NULL,
+                digest TEXT NOT NULL, PRIMARY KEY (project, repo, gid, digest))''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS fingerprints (
+                project TEXT NOT NULL, repo TEXT NOT NULL, gid INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL, PRIMARY KEY (project, repo, gid))''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS imports (
+                project TEXT NOT NULL, repo TEXT NOT NULL, id INTEGER NOT NULL,
+                gid INTEGER NOT NULL, state TEXT NOT NULL, fingerprint TEXT NOT NULL,
+                digests TEXT NOT NULL, created TEXT, PRIMARY KEY (project, repo, id))''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS labels (
+                repo TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (repo, name))''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS milestones (
+                repo TEXT NOT NULL, name TEXT NOT NULL, number INTEGER NOT NULL,
+                PRIMARY KEY (repo, name))''')
+
+    def issues(self):
+        """ Returns an index of migrated issues, in the form of get_existing_github_issues. """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT gid, number, state FROM issues WHERE project = ? AND repo = ?',
+                (self.project, self.repo))
+            return dict((gid, (number, state)) for gid, number, state in rows)
+
+    def is_complete(self, gcode_issue):
+        """ Returns whether the given issue was fully synced, with its current state and comments. """
+
+        with self.lock:
+            row = self.connection.execute('SELECT state, synced FROM issues WHERE project = ? AND repo = ? AND gid = ?',
+                (self.project, self.repo, gcode_issue['gid'])).fetchone()
+        if row is None or row[0] != gcode_issue['state'] or not row[1]:
+            return False
+        digests = self.comment_digests(gcode_issue['gid'])
+        return all(comment_digest(render_comment(comment)) in digests for comment in gcode_issue['comments'])
+
+    def comment_digests(self, gid):
+        with self.lock:
+            rows = self.connection.execute('SELECT digest FROM comments WHERE project = ? AND repo = ? AND gid = ?',
+                (self.project, self.repo, gid))
+            return set(row[0] for row in rows)
+
+    def record_issue(self, gid, number, state):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, 0, ?)',
+                (self.project, self.repo, gid, number, state, time.time()))
+
+    def record_comments(self, gid, digests):
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO comments VALUES (?, ?, ?, ?)',
+                ((self.project, self.repo, gid, digest) for digest in digests))
+
+    def fingerprints(self):
+        """ Returns the fingerprints of the issues as they were when last fully synced. """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT gid, fingerprint FROM fingerprints WHERE project = ? AND repo = ?',
+                (self.project, self.repo))
+            return dict(rows.fetchall())
+
+    def record_fingerprint(self, gid, fingerprint):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)',
+                (self.project, self.repo, gid, fingerprint))
+
+    def pending_imports(self):
+        """ Returns the imports that were submitted but not seen to finish, by import ID, in
+        the form of GithubImporter.pending.
+        """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT id, gid, state, fingerprint, digests, created FROM imports WHERE project = ? AND repo = ?',
+                (self.project, self.repo))
+            return dict((import_id, (gid, state, fingerprint, json.loads(digests), created))
+                for import_id, gid, state, fingerprint, digests, created in rows)
+
+    def record_import(self, import_id, gid, state, fingerprint, digests, created):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.project, self.repo, import_id, gid, state, fingerprint, json.dumps(digests), created))
+
+    def forget_import(self, import_id):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM imports WHERE project = ? AND repo = ? AND id = ?',
+                (self.project, self.repo, import_id))
+
+    def record_imported(self, gid, number, state, fingerprint, digests):
+        """ Records an issue created by the Issue Import API, and that its import finished. """
+
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, 1, ?)',
+                (self.project, self.repo, gid, number, state, time.time()))
+            self.connection.executemany('INSERT OR IGNORE INTO comments VALUES (?, ?, ?, ?)',
+                ((self.project, self.repo, gid, digest) for digest in digests))
+            self.connection.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)',
+                (self.project, self.repo, gid, fingerprint))
+            self.connection.execute('DELETE FROM imports WHERE project = ? AND repo = ? AND gid = ?',
+                (self.project, self.repo, gid))
+
+    def labels(self):
+        """ Returns the names of the labels created in the repository. """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT name FROM labels WHERE repo = ?', (self.repo,))
+            return set(row[0] for row in rows)
+
+    def record_label(self, name):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO labels VALUES (?, ?)', (self.repo, name))
+
+    def milestones(self):
+        """ Returns the numbers of the milestones created in the repository, by name. """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT name, number FROM milestones WHERE repo = ?', (self.repo,))
+            return dict(rows.fetchall())
+
+    def record_milestone(self, name, number):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO milestones VALUES (?, ?, ?)', (self.repo, name, number))
+
+    def record_synced(self, gid, state):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE issues SET state = ?, synced = 1, updated = ? WHERE project = ? AND repo = ? AND gid = ?',
+                (state, time.time(), self.project, self.repo, gid))
+
+    def rebuild(self, existing_issues, with_comments = False):
+        """ Replaces the journal's contents with the given existing Github issues.
+
+        Comment digests are only fetched from Github if with_comments is set, and the
+        issues are then marked synced, so that is_complete can skip them without listing
+        their comments again; otherwise they're recorded as each issue's comments are
+        next synced.
+        """
+
+        with self.connection:
+            self.connection.execute('DELETE FROM issues WHERE project = ? AND repo = ?', (self.project, self.repo))
+            self.connection.execute('DELETE FROM comments WHERE project = ? AND repo = ?', (self.project, self.repo))
+            self.connection.execute('DELETE FROM fingerprints WHERE project = ? AND repo = ?', (self.project, self.repo))
+            for gid, (number, state) in existing_issues.iteritems():
+                self.connection.execute('INSERT INTO issues VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (self.project, self.repo, gid, number, state, int(with_comments), time.time()))
+                if with_comments:
+                    comments = get_github_issue(number, state).get_comments()
+                    self.connection.executemany('INSERT OR IGNORE INTO comments VALUES (?, ?, ?, ?)',
+                        ((self.project, self.repo, gid, comment_digest(comment.body)) for comment in comments))
+
 
 def get_attachments(link, attachments):
+    """ Returns the markdown listing the given attachments, which are the names of the
+    attachments in a Google Code comment, or None for deleted attachments.
+    """
+
     if not attachments:
         return ''
 
     body = u'\n\n'
-    for attachment in (pq(a) for a in attachments):
-        if not attachment('a'): # Skip deleted attachments
+    for name in attachments:
+        if name is None: # Skip deleted attachments
             continue
 
         # Linking to the comment with the attachment rather than the
         # attachment itself since Google Code uses download tokens for
         # attachments
-        body += u'**Attachment:** [{}]({})'.format(attachment('b').text(), link)
+        body += u'**Attachment:** [{}]({})'.format(name, link)
     return body
 
 
-def get_gcode_issue(issue_summary):
-    def get_author(doc):
-        userlink = doc('.userlink')
-        return '[{}](https://code.google.com{})'.format(userlink.text(), userlink.attr('href'))
+class GoogleCodeCache(object):
+    """ On-disk cache of scraped Google Code pages, keyed by project and page.
 
-    # Populate properties available from the summary CSV
-    issue = {
-        'gid': int(issue_summary['ID']),
-        'title': issue_summary['Summary'].replace('%', '&#37;'),
-        'link': GOOGLE_URL.format(google_project_name, issue_summary['ID']),
-        'owner': issue_summary['Owner'],
-        'state': 'closed' if issue_summary['Closed'] else 'open',
-        'date': datetime.fromtimestamp(float(issue_summary['OpenedTimestamp'])),
-        'status': issue_summary['Status'].lower()
-    }
+    Each entry is a gzipped JSON document holding the raw page, its SHA-1 and, for issue
+    pages, the fields parsed from it.  Re-runs can then skip both the download and the
+    parse, and --offline runs can migrate without contacting Google Code at all.
+    """
+
+    def __init__(self, path, project, max_age = None, max_size = None):
+        self.path = os.path.join(path, project)
+        self.max_age = max_age
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.json.gz')
+
+    def load(self, key):
+        """ Returns the cached entry with the given key, or None if it is missing or invalid.
+
+        Entries written by an older version of the parser keep their page, but lose their
+        parsed fields so that the page is parsed again.
+        """
+
+        try:
+            with gzip.open(self.filename(key), 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (IOError, ValueError):
+            return None
+
+        page = entry.get('page')
+        if page is None or hashlib.sha1(page.encode('utf-8')).hexdigest() != entry.get('sha1'):
+            logging.warn('Discarding corrupt cache entry %s', key)
+            return None
+        if entry.get('version') != GOOGLE_CACHE_VERSION:
+            entry['parsed'] = None
+        return entry
+
+    def store(self, key, page, parsed = None, fingerprint = None):
+        entry = {
+            'version': GOOGLE_CACHE_VERSION,
+            'fetched': time.time(),
+            'sha1': hashlib.sha1(page.encode('utf-8')).hexdigest(),
+            'page': page,
+            'parsed': parsed,
+            'fingerprint': fingerprint
+        }
+
+        atomic_write(self.filename(key), json.dumps(entry).encode('utf-8'), compress = True)
+
+    def evict(self):
+        evicted = evict_cache_entries(self.path, self.max_age, self.max_size)
+        if evicted:
+            logging.info('Evicted %d entries from the Google Code cache', evicted)
+
+
+def evict_cache_entries(path, max_age = None, max_size = None):
+    """ Removes the files in the given cache directory that are older than max_age days,
+    then the oldest remaining files until it's no larger than max_size megabytes.  Returns
+    the number of files removed.
+    """
+
+    entries = []
+    for name in os.listdir(path):
+        filename = os.path.join(path, name)
+        stat = os.stat(filename)
+        entries.append((stat.st_mtime, stat.st_size, filename))
+    entries.sort()
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    evicted = 0
+    for mtime, size, filename in entries:
+        expired = max_age is not None and now - mtime > max_age * 86400
+        oversized = max_size is not None and total_size > max_size * 1024 * 1024
+        if not expired and not oversized:
+            continue
+        os.remove(filename)
+        total_size -= size
+        evicted += 1
+    return evicted
+
+
+class GithubResponseCache(object):
+    """ On-disk cache of Github API responses, revalidated with conditional requests.
+
+    Successful GET responses that carry an ETag or Last-Modified header are kept, keyed
+    by URL, and later requests for the same URL send them back in If-None-Match and
+    If-Modified-Since headers.  Github answers those with 304 Not Modified if nothing has
+    changed, which doesn't count against the rate-limit, and the cached response is used
+    instead.  Using an entry marks it as recent, so eviction removes the least recently
+    used entries first.
+    """
+
+    def __init__(self, path, max_size = None):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def install(self, github_client):
+        """ Makes the given Github client send all of its requests through this cache. """
+
+        # As with RateLimitScheduler.install, there's no hook for this, but every request
+        # ends up in the requester's private __requestRaw method.
+        requester = github_client._Github__requester
+        request_raw = requester._Requester__requestRaw
+        def cached_request_raw(verb, url, headers, input):
+            return self.request(request_raw, verb, url, headers, input)
+        requester._Requester__requestRaw = cached_request_raw
+
+    def filename(self, url, headers):
+        # Different credentials may be shown different data, so they're part of the key
+        key = '\0'.join([url, headers.get('Accept', ''), headers.get('Authorization', '')])
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest() + '.json.gz')
+
+    def load(self, filename):
+        try:
+            with gzip.open(filename, 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, ValueError):
+            return None
+
+    def store(self, filename, entry):
+        atomic_write(filename, json.dumps(entry).encode('utf-8'), compress = True)
+
+    def request(self, request_raw, verb, url, headers, input):
+        if verb != 'GET':
+            return request_raw(verb, url, headers, input)
+
+        filename = self.filename(url, headers)
+        entry = self.load(filename)
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        status, response_headers, output = request_raw(verb, url, headers, input)
+
+        if status == 304 and entry:
+            with self.lock:
+                self.hits += 1
+            os.utime(filename, None)
+            # Keep the fresh rate-limit headers, but the cached pagination links
+            cached_headers = dict(entry['headers'])
+            cached_headers.update((name, value) for name, value in response_headers.iteritems() if name.startswith('x-ratelimit-'))
+            return entry['status'], cached_headers, entry['output'].encode('utf-8')
+
+        with self.lock:
+            self.misses += 1
+        if status == 200 and ('etag' in response_headers or 'last-modified' in response_headers):
+            self.store(filename, {
+                'status': status,
+                'headers': response_headers,
+                'output': output.decode('utf-8'),
+                'etag': response_headers.get('etag'),
+                'last_modified': response_headers.get('last-modified')
+            })
+        return status, response_headers, output
+
+    def evict(self):
+        evicted = evict_cache_entries(self.path, max_size = self.max_size)
+        if evicted:
+            logging.info('Evicted %d entries from the Github cache', evicted)
+
+
+class AttachmentStore(object):
+    """ Local copies of Google Code attachments, storing each distinct file once by its SHA-256.
+
+    Google Code's download links carry short-lived tokens, so attachments are downloaded
+    as their issue pages are scraped, on the scraping threads, over their kept-alive
+    connections.  An index maps each download link, without its token, to the digest of
+    the file, so that every attachment is only downloaded once, and records which files
+    have been uploaded to which mirror.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.duplicates = 0
+        if not os.path.isdir(os.path.join(path, 'blobs')):
+            os.makedirs(os.path.join(path, 'blobs'))
+        # The index is shared by the scraping threads, which take turns using it
+        self.connection = sqlite3.connect(os.path.join(path, 'attachments.db'), check_same_thread = False)
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS sources (
+                url TEXT NOT NULL PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS uploads (
+                target TEXT NOT NULL, sha256 TEXT NOT NULL, PRIMARY KEY (target, sha256))''')
+
+    def blob_path(self, sha256):
+        return os.path.join(self.path, 'blobs', sha256[:2], sha256)
+
+    def read(self, sha256):
+        with open(self.blob_path(sha256), 'rb') as f:
+            return f.read()
+
+    def fetch_issue(self, issue):
+        """ Downloads the files attached to the given issue, adding their digests to it. """
+
+        for attachment in issue['attachments']:
+            for attached in attachment['files']:
+                attached['sha256'] = self.fetch(attached['url'])
+
+    def fetch(self, url):
+        """ Returns the SHA-256 of the file at the given download link, downloading it if
+        it isn't in the store yet, or None if it can't be downloaded.
+        """
+
+        # Attachment names aren't escaped in their links, and download tokens change
+        # every time a page is scraped
+        url = urllib.quote(url.encode('utf-8'), safe = "%/:=&?~#+!$,;'@()*[]")
+        parts = urlparse.urlsplit(url)
+        query = sorted((name, value) for name, value in urlparse.parse_qsl(parts.query) if name != 'token')
+        source = urlparse.urlunsplit(('', parts.netloc, parts.path, urllib.urlencode(query), ''))
+        with self.lock:
+            row = self.connection.execute('SELECT sha256 FROM sources WHERE url = ?', (source,)).fetchone()
+        if row:
+            return row[0]
+        if options.offline:
+            return None
+
+        try:
+            with metrics.timer('attachment_download'):
+                status, _, data = gcode_connections.get(url, gcode_headers())
+        except (httplib.HTTPException, socket.error) as e:
+            logging.warn('Failed to download attachment %s: %s', url, e)
+            return None
+        if status != 200:
+            logging.warn('Failed to download attachment %s: status %d', url, status)
+            return None
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        filename = self.blob_path(sha256)
+        with self.lock:
+            self.downloaded += 1
+            if os.path.exists(filename):
+                self.duplicates += 1
+            else:
+                if not os.path.isdir(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                atomic_write(filename, data)
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', (source, sha256, len(data)))
+        return sha256
+
+    def uploaded(self, target):
+        """ Returns the digests of the files uploaded to the given target. """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT sha256 FROM uploads WHERE target = ?', (target,))
+            return set(row[0] for row in rows)
+
+    def record_upload(self, target, sha256):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO uploads VALUES (?, ?)', (target, sha256))
+
+
+class AttachmentUploader(object):
+    """ Uploads files from an AttachmentStore to Github, for migrated issues to link to.
+
+    Files are committed to a branch of the repository through the contents API, one
+    request each, or uploaded as the assets of a release.  Either way, each file is named
+    after its SHA-256, so that its link is known before it's uploaded, and is uploaded
+    only once.  The branch or release is created when the first file is uploaded; both
+    need a repository with at least one commit.
+    """
+
+    def __init__(self, store, scheduler, repo, kind, name, login, password):
+        self.store = store
+        self.scheduler = scheduler
+        self.repo = repo
+        self.kind = kind
+        self.name = name
+        self.target = '%s %s %s' % (repo.full_name, kind, name)
+        self.authorization = 'Basic ' + base64.b64encode('%s:%s' % (login, password))
+        self.uploaded = store.uploaded(self.target)
+        self.prepared = False
+        self.upload_url = None
+        self.lock = threading.Lock()
+        self.uploads = 0
+
+    def url(self, sha256):
+        """ Returns the link to the uploaded copy of the file with the given digest. """
+
+        if self.kind == 'release':
+            return '%s/releases/download/%s/%s' % (self.repo.html_url, urllib.quote(self.name), sha256)
+        return '%s/raw/%s/%s' % (self.repo.html_url, urllib.quote(self.name), sha256)
+
+    def pending(self, digests):
+        """ Returns those of the given digests whose files haven't been uploaded yet. """
+
+        return [digest for digest in digests if digest not in self.uploaded]
+
+    def prepare(self, create = True):
+        """ Makes sure that the branch or release to upload to exists.
+
+        Returns the number of requests it takes to create it, which are only made if
+        create is set.
+        """
+
+        requester = self.repo._requester
+        try:
+            if self.kind == 'release':
+                _, release = requester.requestJsonAndCheck('GET', '%s/releases/tags/%s' % (self.repo.url, urllib.quote(self.name)), None, None)
+                self.upload_url = release['upload_url'].split('{')[0]
+            else:
+                requester.requestJsonAndCheck('GET', '%s/git/refs/heads/%s' % (self.repo.url, urllib.quote(self.name)), None, None)
+            return 0
+        except GithubException as e:
+            if e.status != 404:
+                raise
+        if not create:
+            return 1 if self.kind == 'release' else 3
+
+        output('Creating the %s %s for attachments\n' % (self.kind, self.name))
+        if self.kind == 'release':
+            _, release = requester.requestJsonAndCheck('POST', self.repo.url + '/releases', None, {
+                'tag_name': self.name, 'name': 'Google Code attachments',
+                'body': 'Files attached to the issues migrated from Google Code, named after their SHA-256.'})
+            self.upload_url = release['upload_url'].split('{')[0]
+            return 1
+
+        # Start an unrelated history, so that the branch holds nothing but the attachments
+        _, tree = requester.requestJsonAndCheck('POST', self.repo.url + '/git/trees', None, {'tree': [{
+            'path': 'README.md', 'mode': '100644', 'type': 'blob',
+            'content': 'Files attached to the issues migrated from Google Code, named after their SHA-256.\n'}]})
+        _, commit = requester.requestJsonAndCheck('POST', self.repo.url + '/git/commits', None, {
+            'message': 'Add Google Code attachments', 'tree': tree['sha'], 'parents': []})
+        requester.requestJsonAndCheck('POST', self.repo.url + '/git/refs', None, {
+            'ref': 'refs/heads/' + self.name, 'sha': commit['sha']})
+        return 3
+
+    def send(self, verb, url, data):
+        return github_connections.request(verb, url, {
+            'Authorization': self.authorization,
+            'Content-Type': 'application/octet-stream',
+            'User-Agent': 'PyGithub/Python'
+        }, data)
+
+    def upload(self, digests):
+        """ Uploads the files with the given digests, unless they already have been. """
+
+        for sha256 in digests:
+            with self.lock:
+                if sha256 in self.uploaded:
+                    continue
+                if not self.prepared:
+                    self.prepare()
+                    self.prepared = True
+
+                data = self.store.read(sha256)
+                with metrics.timer('attachment_upload'):
+                    if self.kind == 'release':
+                        # Release assets go to a separate upload host, which takes the raw file
+                        status, _, response = self.scheduler.request(self.send, 'POST', '%s?name=%s' % (self.upload_url, sha256), data)
+                    else:
+                        try:
+                            self.repo._requester.requestJsonAndCheck('PUT', '%s/contents/%s' % (self.repo.url, sha256), None, {
+                                'message': 'Add attachment %s' % sha256, 'content': base64.b64encode(data), 'branch': self.name})
+                            status = 201
+                        except GithubException as e:
+                            status, response = e.status, e.data
+                # Github rejects a file that an interrupted run uploaded without recording it
+                if status >= 400 and status != 422:
+                    raise GithubException(status, response)
+
+                self.uploaded.add(sha256)
+                self.uploads += 1
+                self.store.record_upload(self.target, sha256)
+
+
+def mirror_attachments(issue, text):
+    """ Rewrites the attachment links in some text of the given issue to point to the
+    uploaded copies of the files.
+
+    Returns the text, and the digests of the files it now links to.  Attachments that
+    couldn't be downloaded keep linking to Google Code.
+    """
+
+    digests = []
+    if not attachment_uploader:
+        return text, digests
+    for attachment in issue['attachments']:
+        files = attachment['files']
+        if attachment['markdown'] not in text or not files or not all(attached.get('sha256') for attached in files):
+            continue
+        links = [u'**Attachment:** [{}]({})'.format(attached['name'], attachment_uploader.url(attached['sha256'])) for attached in files]
+        text = text.replace(attachment['markdown'], u'\n'.join(links))
+        digests.extend(attached['sha256'] for attached in files)
+    return text, digests
+
+
+class HttpConnectionPool(object):
+    """ Keeps a connection open to each host, on each thread, to reuse for later requests.
+
+    urllib2 and PyGithub open a new connection, with a new TLS handshake, for every
+    request.  Threads each keep their own connections, since a connection can only carry
+    one request at a time.
+    """
+
+    def __init__(self, timeout = HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def install(self, github_client):
+        """ Makes the given Github client send all of its requests over this pool's connections. """
+
+        # Like RateLimitScheduler.install, this relies on all of a client's requests going
+        # through its requester, which makes them all with its private __requestRaw method
+        requester = github_client._Github__requester
+        parts = urlparse.urlsplit(requester._Requester__base_url)
+        def pooled_request(verb, url, headers, input):
+            return self.request(verb, '%s://%s%s' % (parts.scheme, parts.netloc, url), headers, input)
+        requester._Requester__requestRaw = pooled_request
+
+    def reset(self):
+        """ Forgets every connection, without closing them, for use in a forked process. """
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def get(self, url, headers = {}):
+        """ Downloads the given URL, following redirects; returns its status, headers and body. """
+
+        for _ in xrange(HTTP_MAX_REDIRECTS + 1):
+            status, response_headers, body = self.request('GET', url, headers)
+            if status not in (301, 302, 303, 307, 308) or 'location' not in response_headers:
+                break
+            url = urlparse.urljoin(url, response_headers['location'])
+        return status, response_headers, body
+
+    def request(self, verb, url, headers = {}, body = None):
+        """ Makes a request, returning its status, headers (with lowercase names) and body. """
+
+        parts = urlparse.urlsplit(url)
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        key = (parts.scheme, parts.netloc)
+        connections = self.local.__dict__.setdefault('connections', {})
+
+        while True:
+            connection = connections.get(key)
+            # An idle connection has nothing to read unless the server has closed it, which
+            # can be noticed before sending a request that couldn't be retried
+            if connection is not None and connection.sock is not None and select_sockets([connection.sock], [], [], 0)[0]:
+                connection.close()
+                connection = None
+            reused = connection is not None
+            if not reused:
+                connection_class = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+                connection = connections[key] = connection_class(parts.netloc, timeout = self.timeout)
+                with self.lock:
+                    self.opened += 1
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    # Requests and responses written in several parts would otherwise wait
+                    # for the acknowledgement of the first, which is delayed on a kept-alive
+                    # connection
+                    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.request(verb, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                del connections[key]
+                # The server may have closed a connection that was idle before it read the
+                # request, so reads are retried on a new one.  Anything else, and any
+                # request that changes something, may have been carried out already.
+                if not (reused and verb in ('GET', 'HEAD') and connection_was_closed(e)):
+                    raise
+                continue
+            if response.will_close:
+                connection.close()
+                del connections[key]
+            return response.status, dict(response.getheaders()), data
+
+
+def connection_was_closed(error):
+    """ Returns whether a request failed because the server had closed the connection. """
+
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    # A timeout is a socket.error too, but the server may just be slow to answer
+    return isinstance(error, socket.error) and not isinstance(error, socket.timeout) and \
+        error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+
+# Connections kept open to Google Code and to Github, shared by every project migrated
+gcode_connections = HttpConnectionPool()
+github_connections = HttpConnectionPool()
+
+
+def gcode_headers():
+    return {'Cookie': options.google_code_cookie} if options.google_code_cookie else {}
+
+
+def fetch_gcode_page(url):
+    """ Downloads a Google Code page, returning its decoded contents or None if it's missing. """
+
+    status, headers, page = gcode_connections.get(url, gcode_headers())
+    if status >= 400:
+        return None
+    encoding = headers['content-type'].split('charset=')[-1]
+    # Pass "ignore" so malformed page data doesn't abort us
+    return page.decode(encoding, "ignore")
+
+
+def get_gcode_labels(issue_summary):
+    """ Returns the Github labels and milestone for the issue with the given CSV summary row. """
 
     # Build a list of labels to apply to the new issue, including an 'imported' tag that
     # we can use to identify this issue as one that's passed through migration.
@@ -259,49 +1911,125 @@ def get_gcode_issue(issue_summary):
         labels.append(stars_to_label(issue_summary['Stars']))
 
     # Add additional labels based on the issue's state
-    if issue['status'] in STATE_MAPPING:
-        labels.append(STATE_MAPPING[issue['status']])
+    if issue_summary['Status'].lower() in STATE_MAPPING:
+        labels.append(STATE_MAPPING[issue_summary['Status'].lower()])
 
-    issue['labels'] = labels
-    issue['milestone'] = milestone
+    return labels, milestone
 
-    # Scrape the issue details page for the issue body and comments
-    opener = urllib2.build_opener()
-    if options.google_code_cookie:
-        opener.addheaders = [('Cookie', options.google_code_cookie)]
-    # Missing issues may still exist in csv; make sure link is good
-    try:
-        connection = opener.open(issue['link'])
-    except urllib2.HTTPError:
+
+def get_gcode_issue(issue_summary):
+    """ Returns the Google Code issue described by the given CSV summary row.
+
+    The issue details page is read from the cache when possible, and otherwise scraped
+    and added to the cache.  Cached pages are only used while the issue's summary row
+    is unchanged, unless we're offline.  Returns None if the page is missing.
+    """
+
+    # Populate properties available from the summary CSV
+    issue = {
+        'gid': int(issue_summary['ID']),
+        'title': issue_summary['Summary'].replace('%', '&#37;'),
+        'link': GOOGLE_URL.format(google_project_name, issue_summary['ID']),
+        'owner': issue_summary['Owner'],
+        'state': 'closed' if issue_summary['Closed'] else 'open',
+        'date': datetime.fromtimestamp(float(issue_summary['OpenedTimestamp'])),
+        'status': issue_summary['Status'].lower(),
+        'fingerprint': gcode_fingerprint(issue_summary)
+    }
+    issue['labels'], issue['milestone'] = get_gcode_labels(issue_summary)
+
+    cache_key = 'issue-%d' % issue['gid']
+    entry = gcode_cache.load(cache_key) if gcode_cache else None
+    if entry and not options.offline and entry.get('fingerprint') != issue['fingerprint']:
+        entry = None
+    if entry and entry['parsed']:
+        issue.update(entry['parsed'])
+        if attachment_store:
+            attachment_store.fetch_issue(issue)
+        return issue
+
+    if entry:
+        page = entry['page']
+    elif options.offline:
+        logging.warn('Skipping issue %d: not in the Google Code cache', issue['gid'])
         return None
-    encoding = connection.headers['content-type'].split('charset=')[-1]
-    # Pass "ignore" so malformed page data doesn't abort us
-    doc = pq(connection.read().decode(encoding, "ignore"))
+    else:
+        # Missing issues may still exist in csv; make sure link is good
+        with metrics.timer('page_download'):
+            page = fetch_gcode_page(issue['link'])
+        if page is None:
+            return None
+
+    with metrics.timer('page_parse'):
+        parse_gcode_issue_page(issue, page)
+    if gcode_cache:
+        gcode_cache.store(cache_key, page, dict((key, issue[key]) for key in ('author', 'content', 'comments', 'attachments')),
+            issue['fingerprint'])
+    if attachment_store:
+        attachment_store.fetch_issue(issue)
+    return issue
+
+
+def gcode_fingerprint(issue_summary):
+    """ Returns a digest of the given CSV summary row.
+
+    Google Code updates an issue's modification time, which is part of the row, whenever
+    it's commented on or edited, so the fingerprint changes along with the issue page.
+    """
+
+    return hashlib.sha1(json.dumps(sorted(issue_summary.items()))).hexdigest()
 
-    description = doc('.issuedescription .issuedescription')
-    issue['author'] = get_author(description)
+
+def split_comment(issue, comment, text):
+    """ Adds the given comment to the issue's comments, with the given text as its body. """
+
+    # Github has an undocumented maximum comment size (unless I just failed
+    # to find where it was documented), so split comments up into multiple
+    # posts as needed.
+    while text:
+        comment['body'] = text[:7000]
+        text = text[7000:]
+        if text:
+            comment['body'] += '...'
+            text = '...' + text
+        issue['comments'].append(comment.copy())
+
+
+def set_gcode_issue_content(issue, text, attachments):
+    """ Sets the issue's content from the text and attachments of its description. """
 
     issue['comments'] = []
-    def split_comment(comment, text):
-        # Github has an undocumented maximum comment size (unless I just failed
-        # to find where it was documented), so split comments up into multiple
-        # posts as needed.
-        while text:
-            comment['body'] = text[:7000]
-            text = text[7000:]
-            if text:
-                comment['body'] += '...'
-                text = '...' + text
-            issue['comments'].append(comment.copy())
-
-    split_comment(issue, description('pre').text())
+    split_comment(issue, issue, text)
     issue['content'] = u'_From {author} on {date:%B %d, %Y %H:%M:%S}_\n\n{content}{attachments}\n\n{footer}'.format(
             content = issue['comments'].pop(0)['body'],
             footer = GOOGLE_ISSUE_TEMPLATE.format(GOOGLE_URL.format(google_project_name, issue['gid'])),
-            attachments = get_attachments(issue['link'], doc('.issuedescription .issuedescription .attachments')),
+            attachments = get_attachments(issue['link'], attachments),
             **issue)
-
     issue['comments'] = []
+    issue['attachments'] = []
+
+
+def parse_gcode_issue_page(issue, page):
+    """ Fills in the given issue's author, content and comments from its details page. """
+
+    if options.parser == 'lxml':
+        return parse_gcode_issue_page_lxml(issue, page)
+
+    def get_author(doc):
+        userlink = doc('.userlink')
+        return '[{}](https://code.google.com{})'.format(userlink.text(), userlink.attr('href'))
+
+    def get_attachment_names(attachments):
+        return [pq(a)('b').text() if pq(a)('a') else None for a in attachments]
+
+    doc = pq(page)
+
+    description = doc('.issuedescription .issuedescription')
+    issue['author'] = get_author(description)
+    attachments = doc('.issuedescription .issuedescription .attachments')
+    set_gcode_issue_content(issue, description('pre').text(), get_attachment_names(attachments))
+    add_gcode_attachments(issue, issue['link'], attachments)
+
     for comment in doc('.issuecomment'):
         comment = pq(comment)
         if not comment('.date'):
@@ -321,52 +2049,281 @@ def get_gcode_issue(issue_summary):
         if updates:
             body += '\n\n' + updates.html().strip().replace('\n', '').replace('<b>', '**').replace('</b>', '**').replace('<br/>', '\n')
 
-        body += get_attachments('{}#{}'.format(issue['link'], comment.attr('id')), comment('.attachments'))
+        link = '{}#{}'.format(issue['link'], comment.attr('id'))
+        body += get_attachments(link, get_attachment_names(comment('.attachments')))
+        add_gcode_attachments(issue, link, comment('.attachments'))
+
+        # Strip the placeholder text if there's any other updates
+        body = body.replace('(No comment was entered for this change.)\n\n', '')
+
+        split_comment(issue, {'date': date, 'author': author}, body)
+
+    return issue
+
+
+def xpath_class(name):
+    """ Returns an XPath step selecting elements with the given class, as a CSS selector would. """
+    return "*[@class and contains(concat(' ', normalize-space(@class), ' '), ' %s ')]" % name
+
+# Precompiled queries used by the lxml parser.  These are the same queries that PyQuery
+# generates from the CSS selectors used by the default parser, so they select exactly the
+# same elements, without translating the selectors again for every comment.
+GCODE_DESCRIPTION_XPATH = etree.XPath('descendant-or-self::%s/descendant-or-self::*/%s' % (xpath_class('issuedescription'), xpath_class('issuedescription')))
+GCODE_DESCRIPTION_ATTACHMENTS_XPATH = etree.XPath('descendant-or-self::%s/descendant-or-self::*/%s/descendant-or-self::*/%s' % (xpath_class('issuedescription'), xpath_class('issuedescription'), xpath_class('attachments')))
+GCODE_COMMENTS_XPATH = etree.XPath('descendant-or-self::' + xpath_class('issuecomment'))
+GCODE_DELETED_XPATH = etree.XPath('self::' + xpath_class('delcom'))
+GCODE_DATE_XPATH = etree.XPath('descendant-or-self::' + xpath_class('date'))
+GCODE_UPDATES_XPATH = etree.XPath('descendant-or-self::%s/descendant-or-self::*/%s' % (xpath_class('updates'), xpath_class('box-inner')))
+GCODE_ATTACHMENTS_XPATH = etree.XPath('descendant-or-self::' + xpath_class('attachments'))
+GCODE_USERLINK_XPATH = etree.XPath('descendant-or-self::' + xpath_class('userlink'))
+GCODE_PRE_XPATH = etree.XPath('descendant-or-self::pre')
+GCODE_LINK_XPATH = etree.XPath('descendant-or-self::a')
+GCODE_BOLD_XPATH = etree.XPath('descendant-or-self::b')
+
+
+def add_gcode_attachments(issue, link, attachments):
+    """ Records the files in the given attachment lists of an issue, which get_attachments
+    lists as a link to the given comment link.
+
+    The lists are lxml elements, which PyQuery objects hold too.  Each file's name is in
+    bold, followed by its Download link unless it was deleted.  The names and links are
+    recorded along with the exact markdown that lists them, so that the markdown can be
+    rewritten to link to mirrored copies.
+    """
+
+    for element in attachments:
+        if not GCODE_LINK_XPATH(element):
+            continue # Deleted attachments aren't listed
+        files = []
+        name = None
+        for node in element.iter('a', 'b'):
+            if node.tag == 'b':
+                name = element_text([node])
+            elif name and node.get('href') and element_text([node]) == 'Download':
+                files.append({'name': name, 'url': urlparse.urljoin('https://code.google.com/', node.get('href'))})
+                name = None
+        name = element_text(GCODE_BOLD_XPATH(element))
+        issue['attachments'].append({'markdown': u'**Attachment:** [{}]({})'.format(name, link), 'files': files})
+
+
+def select(xpath, elements):
+    """ Returns the results of an XPath query on each of the given elements, like PyQuery. """
+    return [result for element in elements for result in xpath(element)]
+
+
+def element_text(elements):
+    """ Returns the text of the given elements, normalized the same way as PyQuery's text(). """
+
+    if not elements:
+        return None
+
+    text = []
+    def add_text(tag, no_tail = False):
+        if tag.text and not isinstance(tag, etree._Comment):
+            text.append(tag.text)
+        for child in tag:
+            add_text(child)
+        if not no_tail and tag.tail:
+            text.append(tag.tail)
+
+    for tag in elements:
+        add_text(tag, no_tail = True)
+    return ' '.join([t.strip() for t in text if t.strip()])
+
+
+def element_html(element):
+    """ Returns the markup inside the given element, the same way as PyQuery's html(). """
+
+    if not len(element):
+        return element.text
+    return (element.text or '') + u''.join(etree.tostring(child, encoding = unicode) for child in element)
+
+
+def parse_gcode_issue_page_lxml(issue, page):
+    """ Fills in an issue from its details page, like parse_gcode_issue_page, using lxml directly.
+
+    This avoids creating PyQuery objects for every element and translating CSS selectors
+    for every comment, which dominates the parsing time of issues with many comments.
+    """
+
+    def get_author(elements):
+        userlinks = select(GCODE_USERLINK_XPATH, elements)
+        return '[{}](https://code.google.com{})'.format(element_text(userlinks), userlinks[0].get('href') if userlinks else None)
+
+    def get_attachment_names(attachments):
+        return [element_text(GCODE_BOLD_XPATH(a)) if GCODE_LINK_XPATH(a) else None for a in attachments]
+
+    # Parse the page the same way as PyQuery, which tries XML before falling back to HTML
+    try:
+        root = etree.fromstring(page)
+    except etree.XMLSyntaxError:
+        root = lxml_html.fromstring(page)
+
+    description = GCODE_DESCRIPTION_XPATH(root)
+    issue['author'] = get_author(description)
+    attachments = GCODE_DESCRIPTION_ATTACHMENTS_XPATH(root)
+    set_gcode_issue_content(issue, element_text(select(GCODE_PRE_XPATH, description)), get_attachment_names(attachments))
+    add_gcode_attachments(issue, issue['link'], attachments)
+
+    for comment in GCODE_COMMENTS_XPATH(root):
+        dates = GCODE_DATE_XPATH(comment)
+        if not dates:
+            continue # Sign in prompt line uses same class
+        if GCODE_DELETED_XPATH(comment):
+            continue # Skip deleted comments
+
+        date = parse_gcode_date(dates[0].get('title'))
+        body = element_text(GCODE_PRE_XPATH(comment))
+        author = get_author([comment])
+
+        updates = GCODE_UPDATES_XPATH(comment)
+        if updates:
+            body += '\n\n' + element_html(updates[0]).strip().replace('\n', '').replace('<b>', '**').replace('</b>', '**').replace('<br/>', '\n')
+
+        link = '{}#{}'.format(issue['link'], comment.get('id'))
+        attachments = GCODE_ATTACHMENTS_XPATH(comment)
+        body += get_attachments(link, get_attachment_names(attachments))
+        add_gcode_attachments(issue, link, attachments)
 
         # Strip the placeholder text if there's any other updates
         body = body.replace('(No comment was entered for this change.)\n\n', '')
 
-        split_comment({'date': date, 'author': author}, body)
+        split_comment(issue, {'date': date, 'author': author}, body)
 
     return issue
 
-def get_gcode_issues(onlyissues=None):
-    count = 100
+
+def get_gcode_csv_page(start_index, count):
+    """ Returns the lines of one page of the Google Code issues CSV listing.
+
+    Pages are always downloaded fresh, since new issues may have been added, but they're
+    also written to the cache so that --offline runs can replay the listing.
+    """
+
+    cache_key = 'csv-%d-%d' % (start_index, count)
+    if options.offline:
+        entry = gcode_cache.load(cache_key)
+        if entry is None:
+            logging.warn('Issue listing from %d is not in the Google Code cache', start_index)
+            return []
+        page = entry['page']
+    else:
+        url = GOOGLE_ISSUES_URL.format(google_project_name, count, start_index)
+        with metrics.timer('csv_fetch'):
+            status, _, page = gcode_connections.get(url, gcode_headers())
+        if status != 200:
+            raise IOError('Google Code returned status %d for the issue listing %s' % (status, url))
+        page = page.decode('utf-8')
+        if gcode_cache:
+            gcode_cache.store(cache_key, page)
+    return page.encode('utf-8').splitlines(True)
+
+def prefetch_gcode_issues(issue_summaries, depth, workers):
+    """ Yields scraped Google Code issues in the same order as the given summaries.
+
+    Up to `depth` detail pages are downloaded and parsed ahead of the consumer on a pool
+    of `workers` background threads, so that scraping overlaps with the Github requests
+    made for the current issue.  A depth or worker count of zero scrapes serially.
+    """
+
+    if depth < 1 or workers < 1:
+        for summary in issue_summaries:
+            yield get_gcode_issue(summary)
+        return
+
+    pool = ThreadPool(workers)
+    pending = deque()
+    try:
+        for summary in issue_summaries:
+            pending.append(pool.apply_async(get_gcode_issue, (summary,)))
+            if len(pending) > depth:
+                yield pending.popleft().get(GOOGLE_PREFETCH_TIMEOUT)
+        while pending:
+            yield pending.popleft().get(GOOGLE_PREFETCH_TIMEOUT)
+    finally:
+        pool.terminate()
+
+def get_gcode_issues(onlyissues=None, start_at=None):
+    """ Yields the summary rows of the Google Code issues CSV listing, in ID order.
+
+    Rows are yielded as each page of the listing arrives, so that migration can start
+    right away and memory use doesn't grow with the number of issues.  Only the given
+    issue IDs are yielded if onlyissues is set, and none below start_at.
+    """
+
+    onlyissues = set(int(gid) for gid in onlyissues) if onlyissues else None
     start_index = 0
-    issues = []
     while True:
-        url = GOOGLE_ISSUES_URL.format(google_project_name, count, start_index)
-        if onlyissues:
-            issues.extend(row for row in csv.DictReader(urllib2.urlopen(url), dialect=csv.excel) if row['ID'] in onlyissues)
-        else:
-            issues.extend(row for row in csv.DictReader(urllib2.urlopen(url), dialect=csv.excel))
+        rows = list(csv.DictReader(get_gcode_csv_page(start_index, GOOGLE_MAX_RESULTS), dialect=csv.excel))
 
-        if issues and 'truncated' in issues[-1]['ID']:
-            issues.pop()
-            start_index += count
-        else:
-            return issues
+        # Google Code appends a marker row when there are more pages to fetch
+        truncated = rows and 'truncated' in rows[-1]['ID']
+        if truncated:
+            rows.pop()
+
+        gid = None
+        for row in rows:
+            gid = int(row['ID'])
+            if start_at is not None and gid < start_at:
+                continue
+            if onlyissues is not None and gid not in onlyissues:
+                continue
+            yield row
+
+        # The listing is sorted by ID, so stop once we're past the last requested issue
+        if not truncated or gid is None or (onlyissues and gid >= max(onlyissues)):
+            return
+        start_index += GOOGLE_MAX_RESULTS
+
+
+def get_gcode_summaries(onlyissues=None):
+    """ Yields the summary rows of the Google Code issues selected for migration.
+
+    With --since, issues last modified before the given date are left out, and with
+    --delta, so are issues whose summary row hasn't changed since they were last synced.
+    """
+
+    fingerprints = journal.fingerprints() if options.delta else {}
+    for issue_summary in get_gcode_issues(onlyissues, options.start_at):
+        # Closed issues can be recognized from the summary alone, so don't bother scraping them
+        if options.skip_closed and issue_summary['Closed']:
+            continue
+        if options.since is not None and issue_summary.get('ModifiedTimestamp') and float(issue_summary['ModifiedTimestamp']) < options.since:
+            continue
+        if fingerprints.get(int(issue_summary['ID'])) == gcode_fingerprint(issue_summary):
+            continue
+        yield issue_summary
 
 
 def process_gcode_issues(existing_issues, onlyissues=None):
-    """ Migrates all Google Code issues in the given dictionary to Github. """
+    """ Migrates all Google Code issues in the given dictionary to Github.
+
+    With --dry-run or --plan, the migration is only planned, by plan_migration.
+    """
+
+    if options.dry_run or options.plan:
+        plan = plan_migration(existing_issues, onlyissues)
+        describe_plan(plan)
+        if options.plan:
+            write_migration_plan(options.plan, plan)
+            output('Wrote the plan to %s\n' % options.plan)
+        return
 
-    issues = get_gcode_issues(onlyissues)
+    metrics.start(None)
+    issues = prewarm_github_caches(get_gcode_summaries(onlyissues))
     previous_gid = 1
 
+    # Issue numbers are only kept in sync if issues are created one at a time, in order
+    write_queue = WriteQueue(1 if options.synchronize_ids else options.write_workers)
+
     if options.start_at is not None:
-        issues = [x for x in issues if int(x['ID']) >= options.start_at]
         previous_gid = options.start_at - 1
         output('Starting at issue %d\n' % options.start_at)
 
-    for issue in issues:
-        issue = get_gcode_issue(issue)
-
+    for issue in prefetch_gcode_issues(issues, options.prefetch_depth, options.prefetch_workers):
         # problem occured getting issue information from url, may be deleted
         if issue is None:
-            continue
-
-        if options.skip_closed and (issue['state'] == 'closed'):
+            metrics.issue_done(github_scheduler)
             continue
 
         # If we're trying to do a complete migration to a fresh Github project,
@@ -375,55 +2332,333 @@ def process_gcode_issues(existing_issues, onlyissues=None):
         # issues.
         if options.synchronize_ids:
             for gid in xrange(previous_gid + 1, issue['gid']):
-                if gid in existing_issues:
-                    continue
-
-                output('Creating dummy entry for missing issue %d\n' % gid)
-                title = 'Google Code skipped issue %d' % gid
-                body = '_Skipping this issue number to maintain synchronization with Google Code issue IDs._'
-                footer = GOOGLE_ISSUE_TEMPLATE.format(GOOGLE_URL.format(google_project_name, gid))
-                body += '\n\n' + footer
-                github_issue = github_repo.create_issue(title, body = body, labels = [github_label('imported')])
-                github_issue.edit(state = 'closed')
-                existing_issues[previous_gid] = github_issue
+                if gid not in existing_issues:
+                    execute_plan_entry(plan_placeholder(gid), existing_issues)
             previous_gid = issue['gid']
 
         # Add the issue and its comments to Github, if we haven't already
-        if issue['gid'] in existing_issues:
-            github_issue = existing_issues[issue['gid']]
-            output('Not adding issue %d (exists)' % issue['gid'])
-        else:
-            github_issue = add_issue_to_github(issue)
+        if issue['gid'] in existing_issues and journal and journal.is_complete(issue):
+            output('Not syncing issue %d (complete)\n' % issue['gid'])
+            journal.record_fingerprint(issue['gid'], issue['fingerprint'])
+            metrics.issue_done(github_scheduler)
+            continue
 
-        if github_issue:
-            add_comments_to_issue(github_issue, issue)
-            if github_issue.state != issue['state']:
-                github_issue.edit(state = issue['state'])
-        output('\n')
+        write_queue.put(sync_issue_to_github, issue, existing_issues)
+
+        # Github's issue numbers are assigned as imports finish, so when keeping them in
+        # sync with Google Code's, wait for each import before moving on.
+        if github_importer and (options.synchronize_ids or len(github_importer.pending) >= github_importer.batch_size):
+            record_imported_issues(existing_issues, github_importer.wait())
 
         log_rate_info()
 
+    write_queue.join()
+    finish_migration(existing_issues)
+
+def finish_migration(existing_issues):
+    """ Waits for outstanding imports, and reports on the migration. """
+
+    if github_importer:
+        record_imported_issues(existing_issues, github_importer.wait())
+        output('Imported %d issues, %d failed\n' % (github_importer.imported, github_importer.failed))
+
+    if comment_pacer.posted:
+        output('Posted %d comments, pausing %ds between them in total (%ds less than a fixed %ds delay)\n' % (
+            comment_pacer.posted, comment_pacer.slept, comment_pacer.saved(), COMMENT_FIXED_DELAY))
+
+    if metrics.path:
+        metrics.write(github_scheduler)
+
+def sync_issue_to_github(issue, existing_issues):
+    """ Adds the given Google Code issue and its comments to Github, or syncs its copy.
+
+    existing_issues is the index of issues already on Github, which the issue is added
+    to if it's created.
+    """
+
+    existing_issue = existing_issues.get(issue['gid'])
+    cost = estimate_github_requests(issue, existing_issue is None)
+    github_scheduler.reserve(cost)
+    try:
+        execute_plan_entry(plan_issue(issue, existing_issue), existing_issues)
+    finally:
+        github_scheduler.release(cost)
+
+def run_in_worker(function, *args):
+    """ Runs the given function on a write worker, printing its output all at once. """
+
+    with buffered_output():
+        function(*args)
+
+class WriteQueue(object):
+    """ Syncs issues on a pool of write workers, keeping enough queued to keep them all busy.
+
+    With a single worker, each issue is synced on the calling thread as soon as it's put.
+    Progress is counted as issues finish, in the order they were put.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = ThreadPool(workers) if workers > 1 else None
+        self.pending = deque()
+
+    def put(self, function, *args):
+        if not self.pool:
+            function(*args)
+            metrics.issue_done(github_scheduler)
+            return
+
+        # Wait for the oldest issue once enough are queued to keep every worker busy
+        self.pending.append(self.pool.apply_async(run_in_worker, (function,) + args))
+        if len(self.pending) > 2 * self.workers:
+            self.pending.popleft().get(GITHUB_WRITE_TIMEOUT)
+            metrics.issue_done(github_scheduler)
+
+    def join(self):
+        while self.pending:
+            self.pending.popleft().get(GITHUB_WRITE_TIMEOUT)
+            metrics.issue_done(github_scheduler)
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+
+def record_imported_issues(existing_issues, imported):
+    """ Adds the issues imported by the Issue Import API to the index and the journal. """
+
+    for gid, number, state, fingerprint, digests in imported:
+        existing_issues[gid] = (number, state)
+        if journal:
+            journal.record_imported(gid, number, state, fingerprint, digests)
+
+def resume_imports(existing_issues):
+    """ Finds out what became of the imports an interrupted run left in the journal.
+
+    Their issues may well exist on Github already, so they must not be imported again
+    before the imports have been looked up, even if this run doesn't use the API.
+    """
+
+    importer = github_importer or GithubImporter(github_scheduler, github_repo.url, github_user_name, github_password, journal)
+    output('Checking on %d imports from an earlier run\n' % len(journal.pending_imports()))
+    record_imported_issues(existing_issues, importer.resume() + importer.wait())
+
+def plan_migration(existing_issues, onlyissues=None):
+    """ Works out every change needed to migrate the selected Google Code issues to Github.
+
+    Nothing is changed on Github.  Every issue page is scraped, and the comments on issues
+    already on Github are listed, so that the plan holds the text of every issue and
+    comment to post, and the exact number of requests each issue takes.  With
+    --synchronize-ids, the dummy issues that fill gaps in Google Code's numbering are
+    worked out from the IDs in the issue listing, before any page is scraped.
+    """
+
+    summaries = list(get_gcode_summaries(onlyissues))
+    list_github_labels()
+    missing_labels, missing_milestones = missing_github_labels(summaries)
+
+    gaps = deque()
+    last_gid = int(summaries[-1]['ID']) if summaries else 0
+    if options.synchronize_ids:
+        listed = set(int(summary['ID']) for summary in summaries)
+        first_gid = options.start_at if options.start_at is not None else 2
+        gaps.extend(gid for gid in xrange(first_gid, last_gid) if gid not in listed and gid not in existing_issues)
+
+    output('Planning the migration of %d issues...\n' % len(summaries))
+    entries = []
+    issues = prefetch_gcode_issues(summaries, options.prefetch_depth, options.prefetch_workers)
+    for summary, issue in itertools.izip(summaries, issues):
+        gid = int(summary['ID'])
+        while gaps and gaps[0] < gid:
+            entries.append(plan_placeholder(gaps.popleft()))
+
+        # Issues whose page is missing leave a gap too
+        if issue is None:
+            if options.synchronize_ids and gid < last_gid and gid not in existing_issues:
+                entries.append(plan_placeholder(gid))
+            continue
+        entries.append(plan_issue(issue, existing_issues.get(gid)))
+
+    # Files attached to several issues are only uploaded by the first
+    uploads = set()
+    for entry in entries:
+        entry['attachments'] = [digest for digest in entry['attachments'] if digest not in uploads]
+        uploads.update(entry['attachments'])
+        entry['requests'] = plan_requests(entry)
+
+    labels = set()
+    milestones = set()
+    for entry in entries:
+        if entry['issue']:
+            labels.update(entry['issue']['labels'])
+            if entry['issue']['milestone']:
+                milestones.add(entry['issue']['milestone'])
+
+    plan = {
+        'version': MIGRATION_PLAN_VERSION,
+        'project': google_project_name,
+        'repo': github_repo.full_name,
+        'synchronize_ids': options.synchronize_ids,
+        'labels': sorted(label for label in labels if label.lower() in label_cache),
+        'milestones': dict((name, milestone_cache[name].number) for name in milestones if name in milestone_cache),
+        'missing_labels': missing_labels,
+        'missing_milestones': missing_milestones,
+        'attachments': [attachment_uploader.kind, attachment_uploader.name] if attachment_uploader else None,
+        'issues': entries
+    }
+    plan['requests'] = len(missing_labels) + len(missing_milestones) + sum(entry['requests'] for entry in entries)
+    if uploads:
+        # Finding the branch or release, and creating it if it's missing
+        plan['requests'] += 1 + attachment_uploader.prepare(create = False)
+    return plan
+
+def describe_plan(plan):
+    """ Prints the changes in the given migration plan, and the Github requests they take. """
+
+    created = placeholders = imported = comments = edits = uploads = 0
+    for entry in plan['issues']:
+        actions = []
+        if entry['attachments']:
+            actions.append('upload %d attachments' % len(entry['attachments']))
+            uploads += len(entry['attachments'])
+        if entry['placeholder']:
+            actions.append('create a placeholder')
+            placeholders += 1
+        elif entry['issue'] and entry['import']:
+            actions.append('import with %d comments' % len(entry['comments']))
+            imported += 1
+        elif entry['issue']:
+            actions.append('create')
+            created += 1
+        if entry['comments'] and not entry['import']:
+            actions.append('post %d comments' % len(entry['comments']))
+            comments += len(entry['comments'])
+        if entry['github_state'] != entry['state'] and not entry['import']:
+            actions.append('close' if entry['state'] == 'closed' else 'reopen')
+            edits += 1
+        output('Issue %d: %s\n' % (entry['gid'], ', '.join(actions) or 'up to date'))
+
+    output('\nThe plan creates %d issues and %d placeholders, imports %d issues, posts %d comments and closes or reopens %d issues\n' % (
+        created, placeholders, imported, comments, edits))
+    output('It creates %d labels and %d milestones\n' % (len(plan['missing_labels']), len(plan['missing_milestones'])))
+    if uploads:
+        output('It uploads %d attachments to the %s %s\n' % (uploads, plan['attachments'][0], plan['attachments'][1]))
+    output('It takes %d Github requests%s\n' % (plan['requests'], ', plus status checks for the imports' if imported else ''))
+
+    # Work out how many times the migration will have to wait for the rate-limit to reset
+    remaining, limit, spare = github_scheduler.remaining, github_scheduler.limit, github_scheduler.spare
+    if remaining is not None and limit > spare and plan['requests'] > remaining - spare:
+        available = max(remaining - spare, 0)
+        resets = int(math.ceil(float(plan['requests'] - available) / (limit - spare)))
+        output('Only %d can be made before the rate-limit resets, so the migration will wait for %d resets, of up to an hour each\n' % (
+            available, resets))
+
+def write_migration_plan(path, plan):
+    atomic_write(path, json.dumps(plan).encode('utf-8'), compress = True)
+
+def read_migration_plan(path):
+    """ Returns the migration plan in the given file, or None if it's from another version. """
+
+    with gzip.open(path, 'rb') as f:
+        plan = json.loads(f.read().decode('utf-8'))
+    if plan.get('version') != MIGRATION_PLAN_VERSION:
+        return None
+    return plan
+
+def prepare_plan_labels(plan):
+    """ Fills the label and milestone caches for executing the given plan.
+
+    The labels and milestones that already existed when the plan was made aren't listed
+    again, and those that were missing are created, unless the journal shows that an
+    earlier run of the same plan already did.
+    """
+
+    created_labels = journal.labels()
+    created_milestones = journal.milestones()
+    requester = github_repo._requester
+    for name in plan['labels'] + [name for name in plan['missing_labels'] if name in created_labels]:
+        label_cache[name.lower()] = Label(requester, {'name': name}, completed = False)
+    milestones = dict(plan['milestones'])
+    milestones.update((name, created_milestones[name]) for name in plan['missing_milestones'] if name in created_milestones)
+    for name, number in milestones.iteritems():
+        milestone_cache[name] = Milestone(requester, {'number': number, 'title': name}, completed = False)
+
+    create_github_labels([name for name in plan['missing_labels'] if name not in created_labels],
+        [name for name in plan['missing_milestones'] if name not in created_milestones])
+
+def execute_plan(plan, existing_issues):
+    """ Carries out the given migration plan, which was written by --plan.
+
+    The exact cost of each issue is reserved with the rate-limit scheduler before it's
+    synced, and the journal records every step as it's made, so that an interrupted run
+    can be resumed by executing the same plan again.
+    """
+
+    output('Executing a plan of %d Github requests for %d issues\n' % (plan['requests'], len(plan['issues'])))
+    prepare_plan_labels(plan)
+    metrics.start(len(plan['issues']))
+
+    write_queue = WriteQueue(1 if options.synchronize_ids else options.write_workers)
+    for entry in plan['issues']:
+        write_queue.put(execute_planned_issue, entry, existing_issues)
+        if github_importer and (options.synchronize_ids or len(github_importer.pending) >= github_importer.batch_size):
+            record_imported_issues(existing_issues, github_importer.wait())
+        log_rate_info()
+
+    write_queue.join()
+    finish_migration(existing_issues)
+
+def execute_planned_issue(entry, existing_issues):
+    """ Runs execute_plan_entry with the entry's exact cost reserved. """
+
+    # Imports are charged a share of the status checks too, as by estimate_github_requests
+    cost = entry['requests'] + (1 if entry['issue'] and entry['import'] else 0)
+    github_scheduler.reserve(cost)
+    try:
+        execute_plan_entry(entry, existing_issues)
+    finally:
+        github_scheduler.release(cost)
+
+def get_github_issue(number, state):
+    """ Returns a Github issue object for the given issue number, without fetching it.
+
+    The state is filled in from the index of existing issues, so that it can be compared
+    with the Google Code state without an extra request.
+    """
+
+    url = '%s/issues/%d' % (github_repo.url, number)
+    return Issue(github_repo._requester, {'number': number, 'state': state, 'url': url}, completed = False)
+
+
 def get_existing_github_issues():
-    """ Returns a dictionary of Github issues previously migrated from Google Code.
+    """ Returns an index of Github issues previously migrated from Google Code.
 
-    The result maps Google Code issue numbers to Github issue objects.
+    The result maps Google Code issue numbers to (Github issue number, state) tuples.  All
+    issues are listed in a single pass, reading their labels from the listing itself; with
+    --scan-imported-only, only issues carrying the 'imported' label are listed at all.
     """
 
     output("Retrieving existing Github issues...\n")
     id_re = re.compile(GOOGLE_ID_RE % google_project_name)
 
     try:
-        existing_issues = list(github_repo.get_issues(state='open')) + list(github_repo.get_issues(state='closed'))
-        existing_count = len(existing_issues)
+        if options.scan_imported_only:
+            try:
+                existing_issues = github_repo.get_issues(state='all', labels=[github_repo.get_label('imported')])
+            except UnknownObjectException:
+                existing_issues = []
+        else:
+            existing_issues = github_repo.get_issues(state='all')
+
+        existing_count = 0
         issue_map = {}
         for issue in existing_issues:
-            id_match = id_re.search(issue.body)
+            existing_count += 1
+            id_match = id_re.search(issue.body or '')
             if not id_match:
                 continue
 
             google_id = int(id_match.group(1))
-            issue_map[google_id] = issue
-            labels = [l.name for l in issue.get_labels()]
+            issue_map[google_id] = (issue.number, issue.state)
+            labels = [l.name for l in issue.labels]
             if not 'imported' in labels:
                 # TODO we could fix up the label here instead of just warning
                 logging.warn('Issue missing imported label %s- %r - %s', google_id, labels, issue.title)
@@ -436,12 +2671,197 @@ def get_existing_github_issues():
 
 
 def log_rate_info():
-    logging.info('Rate limit (remaining/total) %r', github.rate_limiting)
+    logging.info('Rate limit (remaining/total) %r, waited %ds for resets', github.rate_limiting, github_scheduler.waited)
+    if github_cache:
+        logging.info('Github cache: %d hits, %d misses', github_cache.hits, github_cache.misses)
     # Note: this requires extended version of PyGithub from tfmorris/PyGithub repo
     #logging.info('Rate limit (remaining/total) %s',repr(github.rate_limit(refresh=True)))
 
-if __name__ == "__main__":
-    usage = "usage: %prog [options] <google project name> <github username> <github project>"
+
+def migrate_project(project_name, repo_name):
+    """ Migrates one Google Code project to one Github repository.
+
+    The Github client, its rate-limit scheduler and cache, and the connection pools are
+    set up once by __main__ and shared by every project; everything else is set up
+    afresh for each project.  repo_name is the repository's name, or owner/name if it
+    isn't owned by the user running the script.
+    """
+
+    global label_cache, milestone_cache, comment_pacer, metrics, google_project_name, gcode_cache
+    global attachment_store, github_repo, github_importer, attachment_uploader, journal
+
+    label_cache = {} # Cache Github tags, to avoid unnecessary API requests
+    milestone_cache = {}
+    comment_pacer = CommentPacer(options.comment_pacing)
+    metrics = Metrics(metrics_path(project_name), options.metrics_format, options.progress)
+    google_project_name = project_name
+
+    gcode_cache = None
+    if options.cache_dir:
+        gcode_cache = GoogleCodeCache(options.cache_dir, google_project_name, options.cache_max_age, options.cache_max_size)
+        if not options.offline:
+            gcode_cache.evict()
+
+    attachment_store = None
+    if options.attachments_dir:
+        attachment_store = AttachmentStore(options.attachments_dir)
+
+    # If the project name is specified as owner/project, assume that it's owned by either
+    # a different user than the one we have credentials for, or an organization.
+
+    if "/" in repo_name:
+        owner_name, repo_name = repo_name.split("/")
+        try:
+            github_owner = github.get_user(owner_name)
+        except GithubException:
+            try:
+                github_owner = github.get_organization(owner_name)
+            except GithubException:
+                github_owner = github_user
+    else:
+        github_owner = github_user
+
+    github_repo = github_owner.get_repo(repo_name)
+
+    plan = None
+    if options.execute:
+        plan = read_migration_plan(options.execute)
+        if plan is None:
+            parser.error('%s was planned by a different version of this script' % options.execute)
+        if (plan['project'], plan['repo']) != (google_project_name, github_repo.full_name):
+            parser.error('%s is a plan for migrating %s to %s' % (options.execute, plan['project'], plan['repo']))
+        # Carry the plan out as it was made
+        options.synchronize_ids = plan['synchronize_ids']
+        options.import_api = any(entry['import'] for entry in plan['issues'])
+        if plan['attachments']:
+            if not attachment_store:
+                parser.error('%s uploads attachments, which requires --attachments-dir' % options.execute)
+            options.attachments_target, options.attachments_ref = plan['attachments']
+
+    journal = None
+    if options.journal:
+        journal = MigrationJournal(options.journal, google_project_name, github_repo.full_name)
+
+    github_importer = None
+    if options.import_api:
+        github_importer = GithubImporter(github_scheduler, github_repo.url, github_user_name, github_password, journal)
+
+    attachment_uploader = None
+    if attachment_store:
+        attachment_uploader = AttachmentUploader(attachment_store, github_scheduler, github_repo,
+            options.attachments_target, options.attachments_ref, github_user_name, github_password)
+
+    existing_issues = journal.issues() if journal and not options.rebuild_journal else {}
+    if existing_issues:
+        output('Resuming from %d issues in the journal\n' % len(existing_issues))
+    else:
+        existing_issues = get_existing_github_issues()
+        if journal:
+            journal.rebuild(existing_issues, with_comments = options.rebuild_journal)
+    if journal and journal.pending_imports():
+        resume_imports(existing_issues)
+    log_rate_info()
+    if plan and options.dry_run:
+        describe_plan(plan)
+    elif plan:
+        execute_plan(plan, existing_issues)
+    else:
+        process_gcode_issues(existing_issues, options.only)
+    if github_cache:
+        output('Github cache: %d responses unchanged, %d fetched\n' % (github_cache.hits, github_cache.misses))
+    if attachment_uploader:
+        output('Attachments: %d downloaded, %d of them duplicates, %d uploaded\n' % (
+            attachment_store.downloaded, attachment_store.duplicates, attachment_uploader.uploads))
+
+
+def metrics_path(project_name):
+    """ Returns the --metrics file for the given project, which is named after it in batches. """
+
+    if not options.metrics or not options.batch:
+        return options.metrics
+    root, extension = os.path.splitext(options.metrics)
+    return '%s-%s%s' % (root, project_name, extension)
+
+
+def read_batch_manifest(path):
+    """ Returns the (Google Code project, Github repository) pairs listed in a batch manifest.
+
+    Each line names a Google Code project and the Github repository to migrate it to,
+    separated by whitespace.  Blank lines and everything after a # are ignored.
+    """
+
+    manifest = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 2:
+                raise ValueError('%s:%d: expected a Google Code project and a Github repository' % (path, number))
+            manifest.append(tuple(fields))
+    return manifest
+
+
+def migrate_batch_entry(entry):
+    """ Migrates one project of a batch, returning whether it succeeded. """
+
+    project_name, repo_name = entry
+    output('Migrating %s to %s\n' % entry)
+    try:
+        migrate_project(project_name, repo_name)
+        return True
+    except Exception:
+        logging.exception('Failed to migrate %s to %s', project_name, repo_name)
+        return False
+
+
+def init_batch_worker():
+    # Connections opened before the fork belong to the parent process
+    gcode_connections.reset()
+    github_connections.reset()
+
+
+def migrate_batch(manifest, workers):
+    """ Migrates every project in a batch manifest, returning those that failed.
+
+    With more than one worker, projects are migrated at once in forked processes, which
+    share the Github client and the rate-limit budget of github_scheduler, a
+    SharedRateLimitScheduler.  Each worker starts on the next project as soon as it's
+    done with its last, so while some are scraping Google Code or pausing between
+    comments, the others keep making use of the rate-limit.
+    """
+
+    if workers <= 1:
+        results = itertools.imap(migrate_batch_entry, manifest)
+        return [entry for entry, succeeded in itertools.izip(manifest, results) if not succeeded]
+
+    pool = multiprocessing.Pool(workers, init_batch_worker)
+    try:
+        results = pool.imap(migrate_batch_entry, manifest)
+        failed = []
+        for entry in manifest:
+            while True:
+                try:
+                    # Waiting with a timeout keeps the process responsive to Ctrl-C
+                    succeeded = results.next(1)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+            if not succeeded:
+                failed.append(entry)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failed
+
+
+def make_option_parser():
+    """ Returns the parser for the command line. """
+
+    usage = "usage: %prog [options] <google project name> <github username> <github project>\n       %prog [options] --batch <manifest> <github username>"
     description = "Migrate all issues from a Google Code project to a Github project."
     parser = optparse.OptionParser(usage = usage, description = description)
 
@@ -451,63 +2871,143 @@ if __name__ == "__main__":
     parser.add_option("-s", "--synchronize-ids", action = "store_true", dest = "synchronize_ids", help = "Ensure that migrated issues keep the same ID", default = False)
     parser.add_option("-c", "--google-code-cookie", dest = "google_code_cookie", help = "Cookie to use for Google Code requests. Required to get unmangled names", default = '')
     parser.add_option('--skip-closed', action = 'store_true', dest = 'skip_closed', help = 'Skip all closed bugs', default = False)
+    parser.add_option('--since', dest = 'since', help = 'Only sync issues modified on Google Code since the given date (YYYY-MM-DD)', default = None)
+    parser.add_option('--delta', action = 'store_true', dest = 'delta', help = 'Only sync issues that changed on Google Code since they were last synced (requires --journal)', default = False)
     parser.add_option('--start-at', dest = 'start_at', help = 'Start at the given Google Code issue number', default = None, type = int)
     parser.add_option('--migrate-stars', action = 'store_true', dest = 'migrate_stars', help = 'Migrate binned star counts as labels', default = False)
     parser.add_option("-v", '--verbose', action = 'store_true', dest = 'verbose', help = 'Print more detailed information during migration', default = False)
+    parser.add_option('--prefetch-depth', dest = 'prefetch_depth', help = 'Number of Google Code issue pages to scrape ahead of the issue being migrated (0 to disable)', default = 8, type = int)
+    parser.add_option('--prefetch-workers', dest = 'prefetch_workers', help = 'Number of threads used to scrape Google Code issue pages', default = 4, type = int)
+    parser.add_option('--cache-dir', dest = 'cache_dir', help = 'Cache scraped Google Code pages in the given directory', default = None)
+    parser.add_option('--cache-max-age', dest = 'cache_max_age', help = 'Evict cached pages older than this many days', default = 7, type = float)
+    parser.add_option('--cache-max-size', dest = 'cache_max_size', help = 'Evict the oldest cached pages beyond this many megabytes', default = 1024, type = float)
+    parser.add_option('--github-cache-dir', dest = 'github_cache_dir', help = 'Cache Github responses in the given directory, and revalidate them with conditional requests', default = None)
+    parser.add_option('--github-cache-max-size', dest = 'github_cache_max_size', help = 'Evict the least recently used Github responses beyond this many megabytes', default = 256, type = float)
+    parser.add_option('--attachments-dir', dest = 'attachments_dir', help = 'Download attachments into the given directory, and upload them to Github for migrated issues to link to', default = None)
+    parser.add_option('--attachments-target', dest = 'attachments_target', type = 'choice', choices = ['branch', 'release'], help = 'Where to upload attachments: a branch (default) or the assets of a release', default = 'branch')
+    parser.add_option('--attachments-ref', dest = 'attachments_ref', help = 'Name of the branch or release tag to upload attachments to', default = 'google-code-attachments')
+    parser.add_option('--offline', action = 'store_true', dest = 'offline', help = 'Read Google Code issues only from the cache', default = False)
+    parser.add_option('--comment-pacing', dest = 'comment_pacing', type = 'choice', choices = ['adaptive', 'fixed'], help = 'How to space out comments so they stay in order: adaptive or fixed (5 seconds)', default = 'adaptive')
+    parser.add_option('--journal', dest = 'journal', help = 'Record migrated issues and comments in the given SQLite file, to resume without rescanning Github', default = None)
+    parser.add_option('--rebuild-journal', action = 'store_true', dest = 'rebuild_journal', help = 'Rebuild the journal from the issues and comments on Github', default = False)
+    parser.add_option('--scan-imported-only', action = 'store_true', dest = 'scan_imported_only', help = "Only look for existing issues with the 'imported' label", default = False)
+    parser.add_option('--parser', dest = 'parser', type = 'choice', choices = ['pyquery', 'lxml'], help = 'How to parse Google Code issue pages: pyquery (default) or lxml, which is faster', default = 'pyquery')
+    parser.add_option('--write-workers', dest = 'write_workers', help = 'Number of issues to sync to Github at once (ignored with --synchronize-ids)', default = 1, type = int)
+    parser.add_option('--import-api', action = 'store_true', dest = 'import_api', help = "Create issues with Github's Issue Import API, in a single request each", default = False)
+    parser.add_option('--github-url', dest = 'github_url', help = 'Base URL of the Github API', default = 'https://api.github.com')
+    parser.add_option('--metrics', dest = 'metrics', help = 'Write timings and Github request counts to the given file', default = None)
+    parser.add_option('--metrics-format', dest = 'metrics_format', type = 'choice', choices = ['jsonl', 'prometheus'], help = 'Format of the metrics file: jsonl (default) or prometheus', default = 'jsonl')
+    parser.add_option('--plan', dest = 'plan', help = 'Write a plan of every change the migration makes to the given file, instead of migrating', default = None)
+    parser.add_option('--execute', dest = 'execute', help = 'Carry out a plan written by --plan (requires --journal)', default = None)
+    parser.add_option('--progress', action = 'store_true', dest = 'progress', help = 'Print progress, throughput and the estimated time left after each issue', default = False)
+    parser.add_option('--batch', dest = 'batch', help = 'Migrate every Google Code project and Github repository pair listed in the given file', default = None)
+    parser.add_option('--batch-workers', dest = 'batch_workers', help = 'Number of projects in the batch to migrate at once, each in a process of its own', default = 1, type = int)
     parser.add_option("-o", "--only", dest="only", help="Migrate only the specified issues. Pass a single parameter containing a list of issues IDs, like \"1 3 98 110\"", default=None)
+    return parser
+
 
-    options, args = parser.parse_args()
+def parse_options(parser, argv = None):
+    """ Parses the command line, and checks that its options go together. """
 
-    if len(args) != 3:
+    options, args = parser.parse_args(argv)
+
+    if len(args) != (1 if options.batch else 3):
         parser.print_help()
         sys.exit()
 
+    if options.batch:
+        # These only make sense for a single project
+        for option, name in [(options.only, '--only'), (options.start_at, '--start-at'), (options.plan, '--plan'), (options.execute, '--execute')]:
+            if option is not None:
+                parser.error('%s cannot be used with --batch' % name)
+
     if options.only:
         options.only = options.only.split()
 
-    if options.verbose:
-        logging.basicConfig(level = logging.INFO)
-    else:
-        logging.basicConfig(level = logging.ERROR)
+    if options.offline and not options.cache_dir:
+        parser.error('--offline requires --cache-dir')
 
-    label_cache = {} # Cache Github tags, to avoid unnecessary API requests
-    milestone_cache = {}
+    if options.rebuild_journal and not options.journal:
+        parser.error('--rebuild-journal requires --journal')
+
+    if options.delta and not options.journal:
+        parser.error('--delta requires --journal')
+
+    if options.execute and not options.journal:
+        parser.error('--execute requires --journal')
 
-    google_project_name, github_user_name, github_project = args
+    if options.execute and options.plan:
+        parser.error('--plan cannot be used with --execute')
 
+    if options.since:
+        # Skipped issues would otherwise be taken for gaps and replaced with dummies
+        if options.synchronize_ids:
+            parser.error('--since cannot be used with --synchronize-ids')
+        try:
+            options.since = time.mktime(datetime.strptime(options.since, '%Y-%m-%d').timetuple())
+        except ValueError:
+            parser.error('--since takes a date in the form YYYY-MM-DD')
+    return options, args
+
+
+def connect_to_github():
+    """ Sets up the Github client that every project is migrated with, asking for the password. """
+
+    global github, github_password, github_scheduler, github_cache, github_user
+
+    # One client, keeping its connections open, makes every Github request
     while True:
         github_password = getpass.getpass("Github password: ")
+        github = Github(github_user_name, github_password, base_url = options.github_url, per_page = GITHUB_PER_PAGE)
+        github_connections.install(github)
         try:
-            Github(github_user_name, github_password).get_user().login
+            github.get_user().login
             break
         except Exception:
             print "Bad credentials, try again."
 
-    github = Github(github_user_name, github_password)
+    github_scheduler = SharedRateLimitScheduler() if options.batch and options.batch_workers > 1 else RateLimitScheduler()
+    github_scheduler.install(github)
+    github_cache = None
+    if options.github_cache_dir:
+        github_cache = GithubResponseCache(options.github_cache_dir, options.github_cache_max_size)
+        github_cache.evict()
+        github_cache.install(github)
     log_rate_info()
     github_user = github.get_user()
 
-    # If the project name is specified as owner/project, assume that it's owned by either
-    # a different user than the one we have credentials for, or an organization.
 
-    if "/" in github_project:
-        owner_name, github_project = github_project.split("/")
+if __name__ == "__main__":
+    parser = make_option_parser()
+    options, args = parse_options(parser)
+
+    if options.batch:
         try:
-            github_owner = github.get_user(owner_name)
-        except GithubException:
-            try:
-                github_owner = github.get_organization(owner_name)
-            except GithubException:
-                github_owner = github_user
+            manifest = read_batch_manifest(options.batch)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+
+    if options.verbose:
+        logging.basicConfig(level = logging.INFO)
     else:
-        github_owner = github_user
+        logging.basicConfig(level = logging.ERROR)
 
-    github_repo = github_owner.get_repo(github_project)
+    if options.batch:
+        github_user_name, = args
+    else:
+        google_project_name, github_user_name, github_project = args
+
+    connect_to_github()
+
+    if options.batch:
+        failed = migrate_batch(manifest, options.batch_workers)
+        output('Migrated %d of %d projects\n' % (len(manifest) - len(failed), len(manifest)))
+        for project_name, repo_name in failed:
+            output('  Failed to migrate %s to %s\n' % (project_name, repo_name))
+        sys.exit(1 if failed else 0)
 
     try:
-        existing_issues = get_existing_github_issues()
-        log_rate_info()
-        process_gcode_issues(existing_issues, options.only)
+        migrate_project(google_project_name, github_project)
     except Exception:
         parser.print_help()
         raise